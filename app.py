@@ -1,21 +1,27 @@
 import streamlit as st
 import psycopg2
+import psycopg2.extensions
+import psycopg2.pool
+import psycopg2.extras
 from psycopg2.extras import RealDictCursor
-import google.generativeai as genai
 import json
 import time
-import tempfile
 import os
+import io
+import multiprocessing
+import sys
 from datetime import datetime
 import random
 import string
 import re
-from docx import Document
-import fitz  
+import threading
+import hashlib
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from contextlib import contextmanager
 import base64
-import requests
-import time
-import json
+# fitz, docx, google.generativeai, requests and pandas are imported where first used,
+# so the login page and plain reruns never load them (see tests/test_import_budget.py)
 st.set_page_config(page_title="Adaptive Quiz & Course System", layout="wide")
 if 'selected_language' not in st.session_state:
     st.session_state.selected_language = 'English'  # default
@@ -26,12 +32,50 @@ language = st.selectbox(
 )
 st.session_state.selected_language = language
 DB_CONFIG = {
-    'host': 'localhost',
-    'database': 'AI_2',
-    'user': 'postgres',
-    'password': '123456',
-    'port': '5432'
+    'host': os.environ.get('DB_HOST', 'localhost'),
+    'database': os.environ.get('DB_NAME', 'AI_2'),
+    'user': os.environ.get('DB_USER', 'postgres'),
+    'password': os.environ.get('DB_PASSWORD', '123456'),
+    'port': os.environ.get('DB_PORT', '5432')
 }
+DB_POOL_MAX_CONN = 20
+DB_POOL_CHECKOUT_TIMEOUT = 10  # seconds a session waits for a free connection
+DB_HEALTH_CHECK_IDLE_SECONDS = 30
+DB_CONNECT_RETRIES = 3
+DB_CONNECT_BACKOFF_BASE = 0.2
+DB_CONNECT_BACKOFF_MAX = 2.0
+LLM_CACHE_MAX_ENTRIES = 512  # in-process LRU tier
+LLM_CACHE_MAX_ROWS = 20000  # Postgres tier
+LLM_CACHE_PRUNE_EVERY = 100  # writes between trims of the Postgres tier
+# Uncached call sites whose prompt is the same for every student, so concurrent callers may share one answer.
+# Cached call sites always share; generated questions never do, so students in one bucket see different ones.
+LLM_SINGLE_FLIGHT_CALL_SITES = {"agent_course_fetch", "agent_trend_fetch"}
+LLM_STRUCTURED_ATTEMPTS = 2  # Gemini calls per structured request before the call site's fallback
+# Call sites that opt in to the response cache, with their TTL in seconds
+LLM_CACHE_TTLS = {
+    "course_content": 7 * 24 * 3600,
+    "weekly_quiz": 24 * 3600,
+    "viva_question": 24 * 3600,
+    "file_summary": 30 * 24 * 3600,
+    "file_chunk_summary": 30 * 24 * 3600,
+    "video_script": 7 * 24 * 3600
+}
+QUESTION_BANK_LOW_WATER = 20  # questions kept in every bucket by fill_question_bank()
+QUESTION_BANK_BATCH_SIZE = 5  # questions requested per Gemini call when filling
+QUESTION_BANK_LANGUAGES = ["English", "Hindi", "Telugu", "Kannada"]
+PREFETCH_MAX_WORKERS = 8
+PREFETCH_WAIT_SECONDS = 15  # how long a submit waits on an in-flight prefetch
+AGENT_MAX_WORKERS = 12
+STUDENT_DATA_TTL_SECONDS = 60  # per-session reuse of get_student_data() between writes
+SUMMARY_SINGLE_PASS_CHARS = 30000  # shorter files are summarized in one call
+SUMMARY_CHUNK_MIN_CHARS = 4000
+SUMMARY_CHUNK_MAX_CHARS = 12000
+SUMMARY_BOUNDARY_MODULUS = 4  # a section closes a chunk when its hash % this == 0
+SUMMARY_MAX_WORKERS = 4
+SUMMARY_CALLS_PER_MINUTE = 30  # Gemini budget shared by all chunk and reduce calls
+PDF_MAX_PAGES = int(os.environ.get("PDF_MAX_PAGES", 500))  # pages beyond this are not extracted
+PDF_PARALLEL_MIN_PAGES = 40  # smaller PDFs are extracted in-process
+PDF_EXTRACT_WORKERS = min(4, os.cpu_count() or 1)
 GEMINI_API_KEY_QUIZ = "API KEY" 
 GEMINI_API_KEY_VIVA = "API KEY"
 GEMINI_API_KEY_AGENT1 = "API KEY"  # Pre-assessment 
@@ -42,134 +86,1037 @@ GEMINI_API_KEY_AGENT5 = "API KEY"  # Course fetch
 GEMINI_API_KEY_AGENT6 = "API KEY"  # Trend fetch
 GEMINI_API_KEY_SUPER = "API KEY"   # Final course
 TAVUS_API_KEY = "API KEY"
+TAVUS_API_URL = os.environ.get("TAVUS_API_URL", "https://tavusapi.com/v2")
+VIDEO_JOB_POLL_BASE = 5  # seconds before the first status check; doubles per check
+VIDEO_JOB_POLL_MAX = 60
+VIDEO_JOB_MAX_AGE = 30 * 60  # jobs still rendering after this are marked expired
+VIDEO_WORKER_IDLE_SLEEP = 2
+GEMINI_MODEL_NAME = 'gemini-2.0-flash'
+# Per-key limits, unset (0) by default: set them to your Gemini tier's quota, e.g. 15 requests/minute on the free tier
+GEMINI_KEY_REQUESTS_PER_MINUTE = float(os.environ.get("GEMINI_KEY_REQUESTS_PER_MINUTE", 0))  # token bucket refill rate
+GEMINI_KEY_BURST = max(1, int(os.environ.get("GEMINI_KEY_BURST", 5)))  # bucket size: calls a rested key may make back to back
+GEMINI_KEY_MAX_IN_FLIGHT = int(os.environ.get("GEMINI_KEY_MAX_IN_FLIGHT", 0))
+GEMINI_KEY_WAIT_MAX = 60  # seconds a call waits for capacity before going out on its own key anyway
+GEMINI_RETRY_ATTEMPTS = 4  # tries per call when Gemini answers 429 or 503
+GEMINI_RETRY_BACKOFF_BASE = 1.0
+GEMINI_RETRY_BACKOFF_MAX = 30.0
+# Call sites that must stay on their own key (comma separated), e.g. to keep a paid key's traffic apart
+GEMINI_PINNED_CALL_SITES = {site for site in os.environ.get("GEMINI_PINNED_CALL_SITES", "").split(",") if site}
+@st.cache_resource
+def get_gemini_registry():
+    """Process-wide registry of long-lived Gemini models, one per (api_key, model, generation_config)"""
+    return {
+        "lock": threading.Lock(),
+        "models": {}
+    }
+def get_gemini_model(api_key, model_name=GEMINI_MODEL_NAME, generation_config=None):
+    """Return the shared model bound to api_key.
+    Each model carries its own client instead of relying on genai.configure(), so
+    concurrent callers on thread pools can never pick up another call site's key.
+    Asyncio code should call generate_content through asyncio.to_thread."""
+    registry = get_gemini_registry()
+    key = (api_key, model_name, json.dumps(generation_config or {}, sort_keys=True))
+    with registry["lock"]:
+        model = registry["models"].get(key)
+        event = "reused"
+        if model is None:
+            import google.generativeai as genai
+            from google.ai import generativelanguage as glm
+            model = genai.GenerativeModel(model_name, generation_config=generation_config)
+            model._client = glm.GenerativeServiceClient(client_options={"api_key": api_key})
+            model._api_key = api_key
+            model._registry_spec = (model_name, generation_config)
+            registry["models"][key] = model
+            event = "created"
+    increment_counter("llm_models_total", {"event": event})
+    return model
+def gemini_model_for_key(model, api_key):
+    """The registry model with the same name and generation_config as model, bound to api_key"""
+    if api_key == model._api_key:
+        return model
+    model_name, generation_config = model._registry_spec
+    return get_gemini_model(api_key, model_name, generation_config)
+def gemini_key_id(api_key):
+    """Short fingerprint used to label a key in metrics without exposing it"""
+    return "key-" + hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:8]
+def new_gemini_key_state(now):
+    return {"tokens": float(GEMINI_KEY_BURST), "refilled": now, "in_flight": 0, "cooldown_until": 0.0,
+            "throttle_streak": 0, "calls": 0, "rerouted": 0, "throttled": 0, "waits": 0, "wait_seconds": 0.0}
+@st.cache_resource
+def get_gemini_key_scheduler():
+    """Process-wide token bucket, in-flight count, 429/503 cooldown and usage counters per Gemini API key"""
+    now = time.monotonic()
+    keys = [GEMINI_API_KEY_QUIZ, GEMINI_API_KEY_VIVA, GEMINI_API_KEY_AGENT1, GEMINI_API_KEY_AGENT2, GEMINI_API_KEY_AGENT3,
+            GEMINI_API_KEY_AGENT4, GEMINI_API_KEY_AGENT5, GEMINI_API_KEY_AGENT6, GEMINI_API_KEY_SUPER]
+    return {"condition": threading.Condition(), "keys": {key: new_gemini_key_state(now) for key in dict.fromkeys(keys)}}
+def acquire_gemini_key(preferred_key, call_site):
+    """Take a request slot on preferred_key and return it. While that key is cooling down after a
+    429/503, out of tokens or at GEMINI_KEY_MAX_IN_FLIGHT, the key with the most spare quota is used
+    instead; pinned call sites wait for their own key. Blocks while no candidate can take the request,
+    for at most GEMINI_KEY_WAIT_MAX. A limit left at 0 is not enforced."""
+    scheduler = get_gemini_key_scheduler()
+    keys = scheduler["keys"]
+    started = time.monotonic()
+    waited = False
+    with scheduler["condition"]:
+        if preferred_key not in keys:
+            keys[preferred_key] = new_gemini_key_state(started)
+        candidates = [preferred_key] if call_site in GEMINI_PINNED_CALL_SITES else list(keys)
+        while True:
+            now = time.monotonic()
+            ready, next_ready = [], now + 1.0
+            for key in candidates:
+                state = keys[key]
+                if GEMINI_KEY_REQUESTS_PER_MINUTE:
+                    state["tokens"] = min(float(GEMINI_KEY_BURST), state["tokens"] + (now - state["refilled"]) * GEMINI_KEY_REQUESTS_PER_MINUTE / 60)
+                    state["refilled"] = now
+                if state["cooldown_until"] > now:
+                    next_ready = min(next_ready, state["cooldown_until"])
+                elif state["tokens"] < 1:
+                    next_ready = min(next_ready, now + (1 - state["tokens"]) * 60 / GEMINI_KEY_REQUESTS_PER_MINUTE)
+                elif not GEMINI_KEY_MAX_IN_FLIGHT or state["in_flight"] < GEMINI_KEY_MAX_IN_FLIGHT:
+                    ready.append(key)
+            if ready or now - started >= GEMINI_KEY_WAIT_MAX:
+                if preferred_key in ready:
+                    key = preferred_key
+                else:
+                    key = max(ready, key=lambda k: keys[k]["tokens"] - keys[k]["in_flight"]) if ready else preferred_key
+                state = keys[key]
+                if GEMINI_KEY_REQUESTS_PER_MINUTE:
+                    state["tokens"] -= 1
+                state["in_flight"] += 1
+                state["calls"] += 1
+                state["rerouted"] += key != preferred_key
+                if waited:
+                    state["waits"] += 1
+                    state["wait_seconds"] += now - started
+                return key
+            waited = True
+            scheduler["condition"].wait(max(0.01, min(next_ready, started + GEMINI_KEY_WAIT_MAX) - now))
+def release_gemini_key(api_key, throttled=False):
+    """Return a slot taken by acquire_gemini_key; a throttled key cools down with jittered exponential backoff"""
+    scheduler = get_gemini_key_scheduler()
+    with scheduler["condition"]:
+        state = scheduler["keys"][api_key]
+        state["in_flight"] -= 1
+        if throttled:
+            delay = min(GEMINI_RETRY_BACKOFF_MAX, GEMINI_RETRY_BACKOFF_BASE * (2 ** state["throttle_streak"]))
+            state["cooldown_until"] = max(state["cooldown_until"], time.monotonic() + delay * random.uniform(0.5, 1.0))
+            state["throttle_streak"] += 1
+            state["throttled"] += 1
+        else:
+            state["throttle_streak"] = 0
+        scheduler["condition"].notify_all()
+def gemini_retryable_status(error):
+    """429 or 503 for google.api_core errors (their .code is the HTTP status), else None"""
+    try:
+        code = int(getattr(error, "code", None))
+    except (TypeError, ValueError):
+        return None
+    return code if code in (429, 503) else None
+def get_gemini_key_usage():
+    """Per-key scheduler counters, labelled by key fingerprint"""
+    scheduler = get_gemini_key_scheduler()
+    with scheduler["condition"]:
+        return {
+            gemini_key_id(key): {name: state[name] for name in ("calls", "rerouted", "throttled", "waits", "wait_seconds", "in_flight", "tokens")}
+            for key, state in scheduler["keys"].items()
+        }
+def get_structured_model(api_key, schema):
+    """Model bound to api_key that answers with JSON matching schema (an OpenAPI-style dict)"""
+    return get_gemini_model(api_key, generation_config={"response_mime_type": "application/json", "response_schema": schema})
 def get_agent1_model():
-    genai.configure(api_key=GEMINI_API_KEY_AGENT1)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_AGENT1)
 def get_agent2_model():
-    genai.configure(api_key=GEMINI_API_KEY_AGENT2)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_AGENT2)
 def get_agent3_model():
-    genai.configure(api_key=GEMINI_API_KEY_AGENT3)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_AGENT3)
 def get_agent4_model():
-    genai.configure(api_key=GEMINI_API_KEY_AGENT4)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_AGENT4)
 def get_agent5_model():
-    genai.configure(api_key=GEMINI_API_KEY_AGENT5)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_AGENT5)
 def get_agent6_model():
-    genai.configure(api_key=GEMINI_API_KEY_AGENT6)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_AGENT6)
 def get_super_agent_model():
-    genai.configure(api_key=GEMINI_API_KEY_SUPER)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_SUPER)
 def get_viva_model():
-    genai.configure(api_key=GEMINI_API_KEY_VIVA)
-    return genai.GenerativeModel('gemini-2.0-flash')
+    return get_gemini_model(GEMINI_API_KEY_VIVA)
 AVAILABLE_COURSES = [
     "Data Science using Python", 
     "Machine Learning with Python", 
     "Generative AI Application Development",
     "Data Analysis and Visualization with Python"
 ]
-def get_db_connection():
-    """Create and return a database connection"""
+METRICS_PORT = int(os.environ.get("METRICS_PORT", 0))  # Prometheus /metrics endpoint (e.g. 9464); 0 disables it
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")  # set to 0.0.0.0 to let other hosts scrape it
+METRICS_PERSIST_SECONDS = int(os.environ.get("METRICS_PERSIST_SECONDS", 0))  # snapshot to app_metrics; 0 disables it
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+METRIC_HELP = {
+    "llm_request_seconds": ("histogram", "Gemini generate_content latency by call site"),
+    "llm_stream_first_token_seconds": ("histogram", "Time until the first streamed chunk (or a cache replay) by call site"),
+    "llm_stream_seconds": ("histogram", "Total duration of streamed responses by call site"),
+    "llm_tokens_total": ("counter", "Prompt and response tokens reported by Gemini"),
+    "llm_errors_total": ("counter", "Gemini calls that raised"),
+    "llm_retries_total": ("counter", "Gemini attempts retried after a 429 or 503"),
+    "llm_single_flight_total": ("counter", "Coalescable calls that ran (leader) or shared a concurrent identical call (merged)"),
+    "llm_parse_failures_total": ("counter", "Gemini responses rejected by their call site's parser"),
+    "llm_json_repairs_total": ("counter", "Structured responses accepted only after local repair"),
+    "llm_structured_retries_total": ("counter", "Extra Gemini calls made because a structured response failed validation"),
+    "llm_models_total": ("counter", "Gemini model lookups that created a client or reused one"),
+    "llm_cache_lookups_total": ("counter", "LLM response cache lookups by call site and result"),
+    "question_prefetch_total": ("counter", "Prefetched next questions that were used, wasted or missed"),
+    "question_generation_fallbacks_total": ("counter", "Failed live question generations, by whether the bank filled in"),
+    "extraction_seconds": ("histogram", "Upload text extraction time by format"),
+    "extraction_pages_total": ("counter", "Pages extracted from uploads by format"),
+    "extraction_bytes_total": ("counter", "Upload bytes extracted by format"),
+    "db_statement_seconds": ("histogram", "cursor.execute latency by statement"),
+    "db_rows_total": ("counter", "Rows returned or affected by statement"),
+    "db_errors_total": ("counter", "cursor.execute calls that raised"),
+}
+@st.cache_resource
+def get_metrics_registry():
+    """Process-wide histograms and counters, keyed by (metric, sorted label pairs)"""
+    return {"lock": threading.Lock(), "histograms": {}, "counters": {}}
+def observe_histogram(metric, labels, value):
+    registry = get_metrics_registry()
+    key = (metric, tuple(sorted(labels.items())))
+    with registry["lock"]:
+        histogram = registry["histograms"].get(key)
+        if histogram is None:
+            histogram = registry["histograms"][key] = {"buckets": [0] * len(LATENCY_BUCKETS), "sum": 0.0, "count": 0}
+        for i, bound in enumerate(LATENCY_BUCKETS):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+                break
+        histogram["sum"] += value
+        histogram["count"] += 1
+def increment_counter(metric, labels, amount=1):
+    registry = get_metrics_registry()
+    key = (metric, tuple(sorted(labels.items())))
+    with registry["lock"]:
+        registry["counters"][key] = registry["counters"].get(key, 0) + amount
+def record_llm_usage(call_site, response):
+    """Count the token usage Gemini reports on a (finished) response, if any"""
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        increment_counter("llm_tokens_total", {"call_site": call_site, "kind": "prompt"}, usage.prompt_token_count)
+        increment_counter("llm_tokens_total", {"call_site": call_site, "kind": "response"}, usage.candidates_token_count)
+def record_llm_parse_failure(call_site):
+    increment_counter("llm_parse_failures_total", {"call_site": call_site})
+def call_gemini(model, prompt, call_site):
+    """model.generate_content(prompt) with latency, token and error metrics; every Gemini call goes through here.
+    The key scheduler may route the call to another key with spare quota; 429/503 answers are retried."""
+    started = time.perf_counter()
     try:
-        conn = psycopg2.connect(**DB_CONFIG)
-        return conn
-    except psycopg2.Error as e:
-        st.error(f"Database connection error: {e}")
+        for attempt in range(GEMINI_RETRY_ATTEMPTS):
+            api_key = acquire_gemini_key(model._api_key, call_site)
+            throttled = False
+            try:
+                response = gemini_model_for_key(model, api_key).generate_content(prompt)
+                text = response.text
+                break
+            except Exception as e:
+                status = gemini_retryable_status(e)
+                throttled = status is not None
+                if not throttled or attempt == GEMINI_RETRY_ATTEMPTS - 1:
+                    raise
+                increment_counter("llm_retries_total", {"call_site": call_site, "status": str(status)})
+            finally:
+                release_gemini_key(api_key, throttled)
+    except Exception:
+        increment_counter("llm_errors_total", {"call_site": call_site})
+        raise
+    finally:
+        observe_histogram("llm_request_seconds", {"call_site": call_site}, time.perf_counter() - started)
+    record_llm_usage(call_site, response)
+    return text
+def stream_gemini(model, prompt, call_site):
+    """Streaming counterpart of call_gemini: yields response chunks, recording metrics when the stream ends.
+    A 429/503 is only retried before the first chunk, so callers never see a repeated prefix."""
+    started = time.perf_counter()
+    try:
+        for attempt in range(GEMINI_RETRY_ATTEMPTS):
+            api_key = acquire_gemini_key(model._api_key, call_site)
+            throttled = yielded = False
+            try:
+                response = gemini_model_for_key(model, api_key).generate_content(prompt, stream=True)
+                for chunk in response:
+                    yielded = True
+                    yield chunk
+                break
+            except Exception as e:
+                status = gemini_retryable_status(e)
+                throttled = status is not None
+                if not throttled or yielded or attempt == GEMINI_RETRY_ATTEMPTS - 1:
+                    raise
+                increment_counter("llm_retries_total", {"call_site": call_site, "status": str(status)})
+            finally:
+                release_gemini_key(api_key, throttled)
+    except Exception:
+        increment_counter("llm_errors_total", {"call_site": call_site})
+        raise
+    finally:
+        observe_histogram("llm_request_seconds", {"call_site": call_site}, time.perf_counter() - started)
+    record_llm_usage(call_site, response)
+SQL_STATEMENT_PATTERN = re.compile(
+    r"^\s*(INSERT\s+INTO\s+(\w+)|UPDATE\s+(\w+)|DELETE\s+FROM\s+(\w+)|(\w+))",
+    re.IGNORECASE
+)
+# String literals, parentheses and FROM clauses: what sql_statement_label needs to find a SELECT's table
+SQL_FROM_TOKENS = re.compile(r"'(?:[^']|'')*'|\(|\)|\bFROM\s+(\w+)", re.IGNORECASE)
+def sql_statement_label(query):
+    """Low-cardinality label for a statement: its verb and main table, e.g. "UPDATE video_jobs".
+    A SELECT is labelled with its first FROM outside parentheses, so subqueries and
+    EXTRACT(... FROM ...) do not name the wrong table."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    query = str(query)
+    match = SQL_STATEMENT_PATTERN.match(query)
+    if not match:
+        return "other"
+    verb = match.group(1).split(None, 1)[0].upper()
+    table = next((group for group in match.groups()[1:4] if group), None)
+    if verb == "SELECT":
+        depth = 0
+        for token in SQL_FROM_TOKENS.finditer(query):
+            if token.group(0) == "(":
+                depth += 1
+            elif token.group(0) == ")":
+                depth -= 1
+            elif token.group(1) and depth == 0:
+                table = token.group(1)
+                break
+    return f"{verb} {table.lower()}" if table else verb
+class InstrumentedCursorMixin:
+    """Times every execute and counts its rows under db_* metrics"""
+    def execute(self, query, vars=None):
+        statement = sql_statement_label(query)
+        started = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        except Exception:
+            increment_counter("db_errors_total", {"statement": statement})
+            raise
+        finally:
+            observe_histogram("db_statement_seconds", {"statement": statement}, time.perf_counter() - started)
+            if self.rowcount > 0:
+                increment_counter("db_rows_total", {"statement": statement}, self.rowcount)
+class InstrumentedCursor(InstrumentedCursorMixin, psycopg2.extensions.cursor):
+    pass
+class InstrumentedRealDictCursor(InstrumentedCursorMixin, RealDictCursor):
+    pass
+class InstrumentedConnection(psycopg2.extensions.connection):
+    """Connection whose cursors, including RealDictCursor ones, are instrumented"""
+    def cursor(self, *args, **kwargs):
+        cursor_factory = kwargs.get("cursor_factory")
+        if cursor_factory in (None, psycopg2.extensions.cursor):
+            kwargs["cursor_factory"] = InstrumentedCursor
+        elif cursor_factory is RealDictCursor:
+            kwargs["cursor_factory"] = InstrumentedRealDictCursor
+        return super().cursor(*args, **kwargs)
+def prometheus_label_string(labels):
+    return ",".join('{}="{}"'.format(name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+                    for name, value in labels)
+def render_prometheus_metrics():
+    """All metrics in the Prometheus text exposition format"""
+    registry = get_metrics_registry()
+    with registry["lock"]:
+        histograms = {key: dict(value, buckets=list(value["buckets"])) for key, value in registry["histograms"].items()}
+        counters = dict(registry["counters"])
+    lines = []
+    for metric, (metric_type, help_text) in METRIC_HELP.items():
+        lines.append(f"# HELP {metric} {help_text}")
+        lines.append(f"# TYPE {metric} {metric_type}")
+        if metric_type == "histogram":
+            for (name, labels), histogram in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                label_string = prometheus_label_string(labels)
+                cumulative = 0
+                for bound, count in zip(LATENCY_BUCKETS, histogram["buckets"]):
+                    cumulative += count
+                    lines.append(f'{metric}_bucket{{{label_string},le="{bound}"}} {cumulative}')
+                lines.append(f'{metric}_bucket{{{label_string},le="+Inf"}} {histogram["count"]}')
+                lines.append(f"{metric}_sum{{{label_string}}} {histogram['sum']}")
+                lines.append(f"{metric}_count{{{label_string}}} {histogram['count']}")
+        else:
+            for (name, labels), value in sorted(counters.items()):
+                if name == metric:
+                    lines.append(f"{metric}{{{prometheus_label_string(labels)}}} {value}")
+    pool = get_db_pool_metrics()
+    for metric, value, help_text in [
+        ("db_pool_in_use", pool["in_use"], "Pooled connections checked out right now"),
+        ("db_pool_idle", pool["idle"], "Pooled connections open and idle"),
+        ("db_pool_max_size", pool["max_size"], "Maximum pooled connections"),
+        ("db_pool_checkout_wait_seconds_max", pool["wait_time_max"], "Longest wait for a pooled connection"),
+    ]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge", f"{metric} {value}"]
+    for metric, value, help_text in [
+        ("db_pool_connects_total", pool["connects"], "Connections opened by the pool"),
+        ("db_pool_checkouts_total", pool["checkouts"], "Connections handed out by the pool"),
+        ("db_pool_checkout_timeouts_total", pool["checkout_timeouts"], "Checkouts that gave up waiting"),
+    ]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter", f"{metric} {value}"]
+    key_usage = get_gemini_key_usage()
+    for metric, field, metric_type, help_text in [
+        ("llm_key_requests_total", "calls", "counter", "Gemini calls sent on each API key"),
+        ("llm_key_rerouted_total", "rerouted", "counter", "Calls moved to this key from their call site's own key"),
+        ("llm_key_throttled_total", "throttled", "counter", "429/503 answers received on each API key"),
+        ("llm_key_waits_total", "waits", "counter", "Calls that waited for capacity before using this key"),
+        ("llm_key_wait_seconds_total", "wait_seconds", "counter", "Time calls spent waiting for capacity"),
+        ("llm_key_in_flight", "in_flight", "gauge", "Gemini calls running on each API key right now"),
+        ("llm_key_tokens", "tokens", "gauge", "Token bucket level of each API key at its last use"),
+    ]:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {metric_type}"]
+        lines += [f'{metric}{{key="{key_id}"}} {usage[field]}' for key_id, usage in sorted(key_usage.items())]
+    return "\n".join(lines) + "\n"
+@st.cache_resource
+def start_metrics_server():
+    """Serve /metrics on METRICS_HOST:METRICS_PORT from a daemon thread, once per process"""
+    if not METRICS_PORT:
         return None
-def create_tavus_video(api_key, script, replica_id="r660c4f3ba"):
-    """Initiates video generation using the Tavus API."""
-    headers = {
-        "x-api-key": api_key,
-        "Content-Type": "application/json"
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split("?")[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render_prometheus_metrics().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        def log_message(self, format, *args):
+            pass
+    try:
+        server = ThreadingHTTPServer((METRICS_HOST, METRICS_PORT), MetricsHandler)
+    except OSError:
+        return None  # another app process on this host already serves the port
+    threading.Thread(target=server.serve_forever, name="metrics-server", daemon=True).start()
+    return server
+def persist_metrics_snapshot():
+    """Append the current cumulative histograms and counters to app_metrics"""
+    registry = get_metrics_registry()
+    with registry["lock"]:
+        rows = [(name, json.dumps(dict(labels)), h["count"], h["sum"]) for (name, labels), h in registry["histograms"].items()]
+        rows += [(name, json.dumps(dict(labels)), value, None) for (name, labels), value in registry["counters"].items()]
+    if not rows:
+        return
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        psycopg2.extras.execute_values(cursor, """
+            INSERT INTO app_metrics (process_id, metric, labels, count, sum) VALUES %s
+        """, [(os.getpid(),) + row for row in rows])
+        conn.commit()
+        cursor.close()
+@st.cache_resource
+def start_metrics_persister():
+    """Snapshot metrics every METRICS_PERSIST_SECONDS from a daemon thread, once per process"""
+    if not METRICS_PERSIST_SECONDS:
+        return None
+    def run():
+        while True:
+            time.sleep(METRICS_PERSIST_SECONDS)
+            try:
+                persist_metrics_snapshot()
+            except Exception:
+                pass
+    worker = threading.Thread(target=run, name="metrics-persister", daemon=True)
+    worker.start()
+    return worker
+@st.cache_resource
+def get_db_pool():
+    """Process-wide pool of Postgres connections shared by every session"""
+    return {
+        "lock": threading.Lock(),
+        "slots": threading.BoundedSemaphore(DB_POOL_MAX_CONN),
+        "idle": [],  # (connection, last_returned_at), most recently used last
+        "started_at": time.time(),
+        "stats": {
+            "checkouts": 0,
+            "in_use": 0,
+            "connects": 0,
+            "connect_retries": 0,
+            "health_check_failures": 0,
+            "checkout_timeouts": 0,
+            "wait_time_total": 0.0,
+            "wait_time_max": 0.0
+        }
     }
-    url = "https://tavusapi.com/v2/videos"
-    payload = {
-        "replica_id": replica_id,
-        "script": script
+def open_db_connection(pool):
+    """Open a new connection, retrying transient failures with jittered backoff"""
+    for attempt in range(DB_CONNECT_RETRIES):
+        try:
+            conn = psycopg2.connect(**DB_CONFIG, connection_factory=InstrumentedConnection)
+            with pool["lock"]:
+                pool["stats"]["connects"] += 1
+            return conn
+        except psycopg2.OperationalError:
+            if attempt == DB_CONNECT_RETRIES - 1:
+                raise
+            with pool["lock"]:
+                pool["stats"]["connect_retries"] += 1
+            backoff = min(DB_CONNECT_BACKOFF_MAX, DB_CONNECT_BACKOFF_BASE * (2 ** attempt))
+            time.sleep(random.uniform(0, backoff))
+def is_db_connection_healthy(conn, last_returned_at):
+    """Cheap liveness check; only round-trips for connections idle long enough to have gone stale"""
+    if conn.closed:
+        return False
+    if time.time() - last_returned_at < DB_HEALTH_CHECK_IDLE_SECONDS:
+        return True
+    try:
+        cursor = conn.cursor()
+        cursor.execute("SELECT 1")
+        cursor.close()
+        conn.rollback()
+        return True
+    except psycopg2.Error:
+        return False
+def checkout_db_connection(pool):
+    """Take a healthy connection from the pool, blocking while all slots are in use"""
+    wait_start = time.perf_counter()
+    if not pool["slots"].acquire(timeout=DB_POOL_CHECKOUT_TIMEOUT):
+        with pool["lock"]:
+            pool["stats"]["checkout_timeouts"] += 1
+        raise psycopg2.pool.PoolError("Timed out waiting for a free database connection")
+    try:
+        conn = None
+        while conn is None:
+            with pool["lock"]:
+                candidate = pool["idle"].pop() if pool["idle"] else None
+            if candidate is None:
+                conn = open_db_connection(pool)
+            elif is_db_connection_healthy(*candidate):
+                conn = candidate[0]
+            else:
+                with pool["lock"]:
+                    pool["stats"]["health_check_failures"] += 1
+                if not candidate[0].closed:
+                    candidate[0].close()
+    except Exception:
+        pool["slots"].release()
+        raise
+    waited = time.perf_counter() - wait_start
+    with pool["lock"]:
+        stats = pool["stats"]
+        stats["checkouts"] += 1
+        stats["in_use"] += 1
+        stats["wait_time_total"] += waited
+        stats["wait_time_max"] = max(stats["wait_time_max"], waited)
+    return conn
+def return_db_connection(pool, conn):
+    """Hand a connection back to the pool, discarding it if it is broken"""
+    try:
+        if not conn.closed:
+            if conn.get_transaction_status() != psycopg2.extensions.TRANSACTION_STATUS_IDLE:
+                conn.rollback()
+            with pool["lock"]:
+                pool["idle"].append((conn, time.time()))
+    except psycopg2.Error:
+        conn.close()
+    finally:
+        with pool["lock"]:
+            pool["stats"]["in_use"] -= 1
+        pool["slots"].release()
+@contextmanager
+def get_db_connection():
+    """Borrow a pooled database connection for the duration of a with-block.
+    Uncommitted work is rolled back when the connection is returned."""
+    pool = get_db_pool()
+    conn = checkout_db_connection(pool)
+    try:
+        yield conn
+    finally:
+        return_db_connection(pool, conn)
+def get_db_pool_metrics():
+    """Snapshot of pool usage: wait time, connections in use and checkout rate"""
+    pool = get_db_pool()
+    with pool["lock"]:
+        stats = dict(pool["stats"])
+        stats["idle"] = len(pool["idle"])
+    uptime = max(time.time() - pool["started_at"], 1e-9)
+    stats["max_size"] = DB_POOL_MAX_CONN
+    stats["checkouts_per_sec"] = stats["checkouts"] / uptime
+    stats["wait_time_avg"] = stats["wait_time_total"] / stats["checkouts"] if stats["checkouts"] else 0.0
+    return stats
+@st.cache_resource
+def get_llm_cache():
+    """In-process LRU tier of the LLM response cache; Postgres (llm_cache) is the shared tier behind it"""
+    return {
+        "lock": threading.Lock(),
+        "entries": OrderedDict(),  # cache_key -> (expires_at, response_text)
+        "db_writes": 0
     }
+def llm_cache_key(model, prompt):
+    """Content address of a request: sha256 over model name, prompt and generation config"""
+    payload = json.dumps(
+        [model.model_name, prompt, getattr(model, "_generation_config", None)],
+        sort_keys=True, default=str
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+def record_llm_cache_event(call_site, event):
+    increment_counter("llm_cache_lookups_total", {"call_site": call_site, "result": event})
+def read_llm_cache(cache, cache_key):
+    """Look a response up in the LRU tier, then in Postgres; expired entries count as misses"""
+    now = time.time()
+    with cache["lock"]:
+        entry = cache["entries"].get(cache_key)
+        if entry is not None:
+            if entry[0] > now:
+                cache["entries"].move_to_end(cache_key)
+                return entry[1], "memory_hits"
+            del cache["entries"][cache_key]
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT response, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP) FROM llm_cache
+                WHERE cache_key = %s AND expires_at > CURRENT_TIMESTAMP
+            """, (cache_key,))
+            row = cursor.fetchone()
+            cursor.close()
+    except psycopg2.Error:
+        return None, "misses"
+    if row is None:
+        return None, "misses"
+    remember_llm_response(cache, cache_key, row[0], now + float(row[1]))
+    return row[0], "db_hits"
+def remember_llm_response(cache, cache_key, text, expires_at):
+    with cache["lock"]:
+        cache["entries"][cache_key] = (expires_at, text)
+        cache["entries"].move_to_end(cache_key)
+        while len(cache["entries"]) > LLM_CACHE_MAX_ENTRIES:
+            cache["entries"].popitem(last=False)
+def write_llm_cache(cache, cache_key, model, call_site, text, ttl):
+    """Store a response in both tiers; every LLM_CACHE_PRUNE_EVERY writes the table is trimmed"""
+    remember_llm_response(cache, cache_key, text, time.time() + ttl)
+    with cache["lock"]:
+        cache["db_writes"] += 1
+        prune = cache["db_writes"] % LLM_CACHE_PRUNE_EVERY == 0
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO llm_cache (cache_key, model_name, call_site, response, expires_at)
+                VALUES (%s, %s, %s, %s, CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                ON CONFLICT (cache_key) DO UPDATE SET
+                    response = EXCLUDED.response,
+                    created_at = CURRENT_TIMESTAMP,
+                    expires_at = EXCLUDED.expires_at
+            """, (cache_key, model.model_name, call_site, text, ttl))
+            if prune:
+                cursor.execute("DELETE FROM llm_cache WHERE expires_at <= CURRENT_TIMESTAMP")
+                cursor.execute("""
+                    DELETE FROM llm_cache WHERE cache_key IN (
+                        SELECT cache_key FROM llm_cache ORDER BY created_at DESC OFFSET %s
+                    )
+                """, (LLM_CACHE_MAX_ROWS,))
+            conn.commit()
+            cursor.close()
+    except psycopg2.Error:
+        pass  # the cache is best effort; the caller already has its response
+@st.cache_resource
+def get_llm_single_flight():
+    """Process-wide table of Gemini calls in progress: cache_key -> Future of the leader's result"""
+    return {"lock": threading.Lock(), "calls": {}}
+def single_flight(cache_key, call_site, run):
+    """Return run(), sharing one execution among concurrent callers with the same cache_key.
+    The first caller runs it; callers arriving meanwhile wait for its result (or exception)."""
+    table = get_llm_single_flight()
+    with table["lock"]:
+        future = table["calls"].get(cache_key)
+        leader = future is None
+        if leader:
+            future = table["calls"][cache_key] = Future()
+    increment_counter("llm_single_flight_total", {"call_site": call_site, "role": "leader" if leader else "merged"})
+    if not leader:
+        return future.result()
+    try:
+        result = run()
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    else:
+        future.set_result(result)
+    finally:
+        with table["lock"]:
+            table["calls"].pop(cache_key, None)
+    return result
+def generate_llm_text(model, prompt, call_site, validate=None, throttle=None):
+    """Run prompt on model and return the response text.
+    Call sites listed in LLM_CACHE_TTLS are served from the response cache; a
+    response is only stored when validate (if given) accepts it, and a rejected
+    response counts as a parse failure. throttle (if given) is called before
+    every request that actually reaches Gemini. Concurrent identical requests share
+    a single Gemini call on cached call sites and LLM_SINGLE_FLIGHT_CALL_SITES."""
+    ttl = LLM_CACHE_TTLS.get(call_site)
+    cache_key = llm_cache_key(model, prompt)
+    if ttl is None:
+        def run():
+            if throttle:
+                throttle()
+            text = call_gemini(model, prompt, call_site)
+            if validate is not None and not validate(text):
+                record_llm_parse_failure(call_site)
+            return text
+        return single_flight(cache_key, call_site, run) if call_site in LLM_SINGLE_FLIGHT_CALL_SITES else run()
+    cache = get_llm_cache()
+    text, event = read_llm_cache(cache, cache_key)
+    record_llm_cache_event(call_site, event)
+    if text is not None:
+        return text
+    def run_and_store():
+        if throttle:
+            throttle()
+        text = call_gemini(model, prompt, call_site)
+        if validate is None or validate(text):
+            write_llm_cache(cache, cache_key, model, call_site, text, ttl)
+        else:
+            record_llm_parse_failure(call_site)
+        return text
+    return single_flight(cache_key, call_site, run_and_store)
+def record_stream_timing(call_site, first_token_seconds, total_seconds):
+    """Time-to-first-token and total duration of a streamed response, as histograms on /metrics"""
+    observe_histogram("llm_stream_first_token_seconds", {"call_site": call_site}, first_token_seconds)
+    observe_histogram("llm_stream_seconds", {"call_site": call_site}, total_seconds)
+def stream_llm_text(model, prompt, call_site):
+    """Yield response text as Gemini streams it, for st.write_stream.
+    Cached call sites replay a cached response as a single chunk; a freshly
+    streamed response is stored in the cache once the stream completes."""
+    started = time.perf_counter()
+    ttl = LLM_CACHE_TTLS.get(call_site)
+    if ttl is not None:
+        cache = get_llm_cache()
+        cache_key = llm_cache_key(model, prompt)
+        text, event = read_llm_cache(cache, cache_key)
+        record_llm_cache_event(call_site, event)
+        if text is not None:
+            elapsed = time.perf_counter() - started
+            record_stream_timing(call_site, elapsed, elapsed)
+            yield text
+            return
+    chunks = []
+    first_token_seconds = None
+    for chunk in stream_gemini(model, prompt, call_site):
+        try:
+            text = chunk.text
+        except ValueError:
+            continue  # chunks without text parts (e.g. the closing finish_reason chunk)
+        if not text:
+            continue
+        if first_token_seconds is None:
+            first_token_seconds = time.perf_counter() - started
+        chunks.append(text)
+        yield text
+    total_seconds = time.perf_counter() - started
+    record_stream_timing(call_site, first_token_seconds if first_token_seconds is not None else total_seconds, total_seconds)
+    if ttl is not None and chunks:
+        write_llm_cache(cache, cache_key, model, call_site, "".join(chunks), ttl)
+def repair_json_text(text, opener, closer):
+    """Cheap local fixes for almost-JSON: code fences, prose around the value, trailing commas"""
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    start, end = text.find(opener), text.rfind(closer)
+    if start != -1 and end > start:
+        text = text[start:end + 1]
+    return re.sub(r",\s*([\]}])", r"\1", text)
+def parse_structured_response(text, expected_type, validate):
+    """Parse a JSON response of expected_type (list or dict) and check it with validate.
+    Returns (value, repaired); raises ValueError when neither the text nor its repair is acceptable."""
+    opener, closer = ("[", "]") if expected_type is list else ("{", "}")
+    repaired = False
     try:
-        response = requests.post(url, json=payload, headers=headers)
+        value = json.loads(text)
+    except ValueError:
+        value = json.loads(repair_json_text(text, opener, closer))
+        repaired = True
+    if expected_type is list and isinstance(value, dict):
+        # A lone object, or the array wrapped in an object ({"questions": [...]})
+        lists = [v for v in value.values() if isinstance(v, list)]
+        value = lists[0] if len(lists) == 1 else [value]
+        repaired = True
+    elif expected_type is dict and isinstance(value, list) and len(value) == 1:
+        value = value[0]
+        repaired = True
+    if not isinstance(value, expected_type) or not validate(value):
+        raise ValueError(f"response is not a valid {expected_type.__name__}")
+    return value, repaired
+def generate_structured(model, prompt, call_site, expected_type, validate):
+    """Run prompt on a structured-output model and return the parsed, validated JSON value.
+    Invalid responses are never cached, so each retry (up to LLM_STRUCTURED_ATTEMPTS calls)
+    reaches Gemini again; raises ValueError once the budget is spent."""
+    def acceptable(text):
+        try:
+            parse_structured_response(text, expected_type, validate)
+            return True
+        except ValueError:
+            return False
+    for attempt in range(LLM_STRUCTURED_ATTEMPTS):
+        if attempt:
+            increment_counter("llm_structured_retries_total", {"call_site": call_site})
+        text = generate_llm_text(model, prompt, call_site, validate=acceptable)
+        try:
+            value, repaired = parse_structured_response(text, expected_type, validate)
+        except ValueError:
+            continue
+        if repaired:
+            increment_counter("llm_json_repairs_total", {"call_site": call_site})
+        return value
+    raise ValueError(f"no valid {call_site} response after {LLM_STRUCTURED_ATTEMPTS} attempts")
+class TavusClient:
+    """Minimal Tavus API client over a shared requests.Session.
+    Point base_url (TAVUS_API_URL) at a local stand-in server to run without Tavus."""
+    def __init__(self, api_key, base_url=TAVUS_API_URL, session=None, timeout=30):
+        self.api_key = api_key
+        self.base_url = base_url.rstrip("/")
+        if session is None:
+            import requests
+            session = requests.Session()
+        self.session = session
+        self.timeout = timeout
+    def create_video(self, script, replica_id="r660c4f3ba"):
+        response = self.session.post(
+            f"{self.base_url}/videos",
+            json={"replica_id": replica_id, "script": script},
+            headers={"x-api-key": self.api_key, "Content-Type": "application/json"},
+            timeout=self.timeout
+        )
         response.raise_for_status()  # Will raise an exception for HTTP error codes
         return response.json()
+    def get_video(self, video_id):
+        response = self.session.get(
+            f"{self.base_url}/videos/{video_id}",
+            headers={"x-api-key": self.api_key},
+            timeout=self.timeout
+        )
+        response.raise_for_status()
+        return response.json()
+@st.cache_resource
+def get_tavus_client():
+    """Process-wide Tavus client; its Session keeps connections to Tavus alive between polls"""
+    return TavusClient(TAVUS_API_KEY)
+def create_tavus_video(script, replica_id="r660c4f3ba"):
+    """Initiates video generation using the Tavus API."""
+    import requests
+    try:
+        return get_tavus_client().create_video(script, replica_id)
     except requests.exceptions.RequestException as e:
         st.error(f"Error creating Tavus video: {e}")
         return None
-
-def check_tavus_video_status(api_key, video_id):
-    """Checks the status of a video being generated by the Tavus API."""
-    headers = {"x-api-key": api_key}
-    url = f"https://tavusapi.com/v2/videos/{video_id}"
+def enqueue_video_job(roll_no, source, script_text):
+    """Start a Tavus render and queue it for the background poller; returns the job id"""
+    create_response = create_tavus_video(script_text)
+    if not (create_response and create_response.get("video_id")):
+        error_msg = create_response.get("error", "Unknown error from API") if create_response else "No response from API"
+        st.error(f"🚫 Failed to start video creation: {error_msg}")
+        return None
     try:
-        response = requests.get(url, headers=headers)
-        response.raise_for_status()
-        return response.json()
-    except requests.exceptions.RequestException as e:
-        st.error(f"Error checking Tavus video status: {e}")
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO video_jobs (roll_no, source, video_id, status, next_poll_at)
+                VALUES (%s, %s, %s, 'queued', CURRENT_TIMESTAMP + %s * INTERVAL '1 second')
+                RETURNING id
+            """, (roll_no, source, create_response["video_id"], VIDEO_JOB_POLL_BASE))
+            job_id = cursor.fetchone()[0]
+            conn.commit()
+            cursor.close()
+    except psycopg2.Error as e:
+        st.error(f"Error saving video job: {e}")
         return None
-def create_data_table():
-    """Create data table for file storage"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
+    start_video_job_worker()
+    return job_id
+def get_video_job(job_id):
     try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("SELECT * FROM video_jobs WHERE id = %s", (job_id,))
+            job = cursor.fetchone()
+            cursor.close()
+        return job
+    except psycopg2.Error as e:
+        st.error(f"Error reading video job: {e}")
+        return None
+def next_video_poll_delay(attempts):
+    """Exponential backoff with jitter between status checks of one job"""
+    return min(VIDEO_JOB_POLL_MAX, VIDEO_JOB_POLL_BASE * (2 ** attempts)) * random.uniform(0.8, 1.2)
+def poll_video_jobs_once(client=None):
+    """Poll every job that is due; returns how many were checked.
+    Due jobs are leased by pushing next_poll_at forward, so several processes can share the table."""
+    with get_db_connection() as conn:
         cursor = conn.cursor()
-        create_data_query = """
-        CREATE TABLE IF NOT EXISTS data (
-            id SERIAL PRIMARY KEY,
-            roll_no VARCHAR(20) NOT NULL,
-            file_name VARCHAR(255) NOT NULL,
-            file_type VARCHAR(50) NOT NULL,
-            file_data TEXT NOT NULL,
-            file_summary TEXT,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (roll_no) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE
-        );"""
-        cursor.execute(create_data_query)
+        cursor.execute("""
+            UPDATE video_jobs SET next_poll_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second'
+            WHERE id IN (
+                SELECT id FROM video_jobs
+                WHERE status NOT IN ('ready', 'failed', 'expired') AND next_poll_at <= CURRENT_TIMESTAMP
+                ORDER BY next_poll_at LIMIT 20
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, video_id, attempts, EXTRACT(EPOCH FROM CURRENT_TIMESTAMP - created_at)
+        """, (VIDEO_JOB_POLL_MAX,))
+        due_jobs = cursor.fetchall()
         conn.commit()
         cursor.close()
-        conn.close()
+    if not due_jobs:
+        return 0
+    import requests
+    client = client or get_tavus_client()
+    for job_id, video_id, attempts, age in due_jobs:
+        status, download_url, error = None, None, None
+        try:
+            response = client.get_video(video_id)
+            status = response.get("status")
+            if status in ("completed", "ready") and response.get("download_url"):
+                status, download_url = "ready", response["download_url"]
+            elif status == "failed":
+                error = response.get("error", "Unknown error")
+        except requests.exceptions.RequestException as e:
+            error = f"Status check failed: {e}"
+        if status not in ("ready", "failed") and age > VIDEO_JOB_MAX_AGE:
+            status = "expired"
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE video_jobs SET
+                    status = COALESCE(%s, status),
+                    download_url = COALESCE(%s, download_url),
+                    error = %s,
+                    attempts = attempts + 1,
+                    next_poll_at = CURRENT_TIMESTAMP + %s * INTERVAL '1 second',
+                    updated_at = CURRENT_TIMESTAMP
+                WHERE id = %s
+            """, (status, download_url, error, next_video_poll_delay(attempts + 1), job_id))
+            conn.commit()
+            cursor.close()
+    return len(due_jobs)
+@st.cache_resource
+def start_video_job_worker():
+    """Start this process's daemon thread that polls Tavus for queued video jobs"""
+    def run():
+        while True:
+            try:
+                polled = poll_video_jobs_once()
+            except Exception:
+                polled = 0
+            time.sleep(0.5 if polled else VIDEO_WORKER_IDLE_SLEEP)
+    worker = threading.Thread(target=run, name="tavus-video-jobs", daemon=True)
+    worker.start()
+    return worker
+def render_video_job(job_id):
+    """Show a video job's current state; never blocks waiting for Tavus"""
+    job = get_video_job(job_id)
+    if not job:
+        return
+    if job["status"] == "ready":
+        st.success("🎉 Your video is ready!")
+        st.video(job["download_url"])
+    elif job["status"] == "failed":
+        st.error(f"🚫 Video creation failed: {job['error'] or 'Unknown error'}")
+    elif job["status"] == "expired":
+        st.warning("⏰ Video is still processing or failed. Please check the Tavus dashboard: [Tavus](https://tavus.com/)")
+    else:
+        st.info(f"⏳ Video `{job['video_id']}` is {job['status']} (checked {job['attempts']} times). "
+                "This can take a few minutes; you can keep using the app meanwhile.")
+        if job["error"]:
+            st.caption(job["error"])
+        st.button("🔄 Refresh video status", key=f"refresh_video_job_{job_id}")
+def store_file_blob(cursor, file_content):
+    """Store file bytes once per SHA-256 and return the digest"""
+    sha256 = hashlib.sha256(file_content).hexdigest()
+    cursor.execute("SELECT 1 FROM file_blobs WHERE sha256 = %s", (sha256,))
+    if cursor.fetchone() is None:
+        cursor.execute("""
+            INSERT INTO file_blobs (sha256, content, size_bytes) VALUES (%s, %s, %s)
+            ON CONFLICT (sha256) DO NOTHING
+        """, (sha256, psycopg2.Binary(file_content), len(file_content)))
+    return sha256
+def save_file_data(roll_no, file_name, file_type, file_content, file_summary, reused_analysis=False):
+    """Save file data and summary to database.
+    reused_analysis counts the reuse of the stored file_analysis row in the same transaction."""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            blob_sha256 = store_file_blob(cursor, file_content)
+            insert_query = """
+            INSERT INTO data (roll_no, file_name, file_type, blob_sha256, file_summary)
+            VALUES (%s, %s, %s, %s, %s)
+            """
+            cursor.execute(insert_query, (roll_no, file_name, file_type, blob_sha256, file_summary))
+            if reused_analysis:
+                cursor.execute("UPDATE file_analysis SET reuse_count = reuse_count + 1 WHERE sha256 = %s", (blob_sha256,))
+            conn.commit()
+            cursor.close()
         return True
     except psycopg2.Error as e:
-        st.error(f"Error creating data table: {e}")
-        if conn:
-            conn.close()
-        return False
-def save_file_data(roll_no, file_name, file_type, file_content, file_summary):
-    """Save file data and summary to database"""
-    conn = get_db_connection()
-    if conn is None:
+        st.error(f"Error saving file data: {e}")
         return False
+def migrate_file_data_to_blobs(batch_size=100):
+    """Move legacy base64 data.file_data rows into file_blobs; returns rows migrated"""
+    migrated = 0
+    while True:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT id, file_data FROM data
+                WHERE blob_sha256 IS NULL AND file_data IS NOT NULL
+                ORDER BY id LIMIT %s FOR UPDATE SKIP LOCKED
+            """, (batch_size,))
+            rows = cursor.fetchall()
+            for row_id, file_data in rows:
+                blob_sha256 = store_file_blob(cursor, base64.b64decode(file_data))
+                cursor.execute("UPDATE data SET blob_sha256 = %s, file_data = NULL WHERE id = %s", (blob_sha256, row_id))
+            conn.commit()
+            cursor.close()
+        migrated += len(rows)
+        if len(rows) < batch_size:
+            return migrated
+def load_file_analysis(sha256):
+    """Return the stored text and summary for an upload's digest, or None"""
     try:
-        cursor = conn.cursor()
-        file_data_encoded = base64.b64encode(file_content).decode('utf-8')       
-        insert_query = """
-        INSERT INTO data (roll_no, file_name, file_type, file_data, file_summary)
-        VALUES (%s, %s, %s, %s, %s)
-        """
-        cursor.execute(insert_query, (roll_no, file_name, file_type, file_data_encoded, file_summary))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)
+            cursor.execute("""
+                SELECT content_type, text_content, file_summary, summary_llm_calls
+                FROM file_analysis WHERE sha256 = %s
+            """, (sha256,))
+            analysis = cursor.fetchone()
+            cursor.close()
+        return analysis
+    except psycopg2.Error as e:
+        st.error(f"Error loading file analysis: {e}")
+        return None
+def save_file_analysis(sha256, content_type, text_content, file_summary, summary_llm_calls):
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO file_analysis (sha256, content_type, text_content, file_summary, summary_llm_calls)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (sha256) DO NOTHING
+            """, (sha256, content_type, text_content, file_summary, summary_llm_calls))
+            conn.commit()
+            cursor.close()
         return True
     except psycopg2.Error as e:
-        st.error(f"Error saving file data: {e}")
-        if conn:
-            conn.close()
+        st.error(f"Error saving file analysis: {e}")
         return False
-def summarize_file_content(content, file_type):
-    """Generate summary of file content using Gemini Viva API"""
-    viva_model = get_viva_model()
-    max_content_length = 30000  
-    if len(content) > max_content_length:
-        content = content[:max_content_length] + "... [Content truncated]"   
-    prompt = f"""
-    Please provide a comprehensive summary of the following {file_type} file content:    
-    Content:
-    {content}   
+def get_file_analysis_stats():
+    """Uploads served from a stored analysis and the summary LLM calls that avoided"""
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                SELECT COALESCE(SUM(reuse_count), 0), COALESCE(SUM(reuse_count * summary_llm_calls), 0)
+                FROM file_analysis
+            """)
+            reuses, avoided_calls = cursor.fetchone()
+            cursor.close()
+        return {"reuses": int(reuses), "avoided_llm_calls": int(avoided_calls)}
+    except psycopg2.Error as e:
+        st.error(f"Error reading file analysis stats: {e}")
+        return {"reuses": 0, "avoided_llm_calls": 0}
+SUMMARY_POINTS = """
     Please provide:
     1. Main topics covered
     2. Key points and highlights
@@ -178,79 +1125,200 @@ def summarize_file_content(content, file_type):
     5. Any actionable insights
     
     Format the summary in a clear, structured manner.
-    """    
+    """
+SECTION_HEADING_PATTERN = re.compile(r"^(?:#{1,6}\s+\S|(?:chapter|section|unit|module)\s+\d+\b|\d+(?:\.\d+)*\.?\s+[A-Z])", re.IGNORECASE | re.MULTILINE)
+def split_into_sections(content):
+    """Split text at page breaks and headings, hard-splitting anything longer than a chunk"""
+    sections = []
+    for page in content.split("\f"):
+        starts = [0] + [m.start() for m in SECTION_HEADING_PATTERN.finditer(page) if m.start() > 0] + [len(page)]
+        for start, end in zip(starts, starts[1:]):
+            section = page[start:end]
+            while len(section) > SUMMARY_CHUNK_MAX_CHARS:
+                cut = section.rfind("\n\n", 0, SUMMARY_CHUNK_MAX_CHARS)
+                cut = cut if cut > SUMMARY_CHUNK_MIN_CHARS else SUMMARY_CHUNK_MAX_CHARS
+                sections.append(section[:cut])
+                section = section[cut:]
+            if section.strip():
+                sections.append(section)
+    return sections
+def chunk_content(content):
+    """Group sections into chunks with content-defined boundaries.
+    A chunk ends after a section whose own hash selects it, so an edit only
+    changes the chunks around it and every other chunk summary stays cached."""
+    chunks, current, size = [], [], 0
+    for section in split_into_sections(content):
+        if current and size + len(section) > SUMMARY_CHUNK_MAX_CHARS:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+        current.append(section)
+        size += len(section)
+        section_hash = int(hashlib.sha256(section.encode("utf-8")).hexdigest()[:8], 16)
+        if size >= SUMMARY_CHUNK_MIN_CHARS and section_hash % SUMMARY_BOUNDARY_MODULUS == 0:
+            chunks.append("\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n".join(current))
+    return chunks
+@st.cache_resource
+def get_summary_executor():
+    return ThreadPoolExecutor(max_workers=SUMMARY_MAX_WORKERS, thread_name_prefix="file-summary")
+@st.cache_resource
+def get_summary_pacer():
+    """Spaces summary requests that miss the cache to SUMMARY_CALLS_PER_MINUTE across all sessions"""
+    return {"lock": threading.Lock(), "next_slot": 0.0}
+def wait_for_summary_slot():
+    pacer = get_summary_pacer()
+    with pacer["lock"]:
+        now = time.monotonic()
+        slot = max(now, pacer["next_slot"])
+        pacer["next_slot"] = slot + 60.0 / SUMMARY_CALLS_PER_MINUTE
+    time.sleep(slot - now)
+def generate_summary_text(prompt, call_site, throttle=None):
+    """generate_llm_text on the Viva model; returns (text, whether the request reached Gemini).
+    Cache hits and requests merged into a concurrent identical one are not Gemini calls."""
+    reached_gemini = []
+    def note_call():
+        reached_gemini.append(True)
+        if throttle:
+            throttle()
+    text = generate_llm_text(get_viva_model(), prompt, call_site, throttle=note_call)
+    return text, bool(reached_gemini)
+def summarize_chunk(chunk, chunk_no, chunk_count, file_type):
+    prompt = f"""
+    The following is part {chunk_no} of {chunk_count} of a {file_type} file.
+    Summarize this part in a few concise bullet points covering its topics, key points and important concepts.
+    Do not add an introduction or conclusion.
+    Content:
+    {chunk}
+    """
+    return generate_summary_text(prompt, "file_chunk_summary", throttle=wait_for_summary_slot)
+def reduce_chunk_summaries(summaries, file_type, stats):
+    """Merge chunk summaries into one summary, in rounds if they are too long for one prompt"""
+    while len(summaries) > 1 and sum(len(s) for s in summaries) > SUMMARY_SINGLE_PASS_CHARS:
+        groups, group, size = [], [], 0
+        for summary in summaries:
+            if group and size + len(summary) > SUMMARY_SINGLE_PASS_CHARS:
+                groups.append(group)
+                group, size = [], 0
+            group.append(summary)
+            size += len(summary)
+        groups.append(group)
+        futures = [get_summary_executor().submit(summarize_chunk, "\n\n".join(g), group_no, len(groups),
+                                                 f"summarized {file_type}")
+                   for group_no, g in enumerate(groups, 1)]
+        results = [future.result() for future in futures]
+        summaries = [summary for summary, _ in results]
+        stats["llm_calls"] += sum(called for _, called in results)
+    numbered = "\n\n".join(f"Part {no}:\n{summary}" for no, summary in enumerate(summaries, 1))
+    prompt = f"""
+    Please provide a comprehensive summary of a {file_type} file, given these summaries of its parts in order:
+    {numbered}
+    {SUMMARY_POINTS}"""
+    summary, called = generate_summary_text(prompt, "file_summary", throttle=wait_for_summary_slot)
+    stats["llm_calls"] += called
+    return summary
+def summarize_file_content(content, file_type, progress=None, stats=None):
+    """Generate summary of file content using Gemini Viva API.
+    Long content is chunked, summarized concurrently and merged (map-reduce);
+    progress (if given) is called with (done, total) as chunks finish, and
+    stats (if given) receives the number of requests that reached Gemini as "llm_calls"."""
+    stats = stats if stats is not None else {}
+    stats["llm_calls"] = 0
     try:
-        response = viva_model.generate_content(prompt)
-        return response.text
+        if len(content) <= SUMMARY_SINGLE_PASS_CHARS:
+            prompt = f"""
+    Please provide a comprehensive summary of the following {file_type} file content:    
+    Content:
+    {content}   
+    {SUMMARY_POINTS}"""
+            summary, called = generate_summary_text(prompt, "file_summary")
+            stats["llm_calls"] += called
+            return summary
+        chunks = chunk_content(content)
+        futures = {get_summary_executor().submit(summarize_chunk, chunk, no, len(chunks), file_type): no
+                   for no, chunk in enumerate(chunks, 1)}
+        summaries = {}
+        for future in as_completed(futures):
+            summaries[futures[future]], called = future.result()
+            stats["llm_calls"] += called
+            if progress:
+                progress(len(summaries), len(chunks))
+        return reduce_chunk_summaries([summaries[no] for no in sorted(summaries)], file_type, stats)
     except Exception as e:
         st.error(f"Error generating summary: {e}")
         return f"Summary generation failed for {file_type} file. Error: {str(e)}"
+@st.cache_resource
+def get_pdf_extract_pool():
+    """Process pool for large PDFs; spawn avoids forking the threaded Streamlit server"""
+    return ProcessPoolExecutor(max_workers=PDF_EXTRACT_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+def record_extraction_throughput(content_type, pages, size_bytes, seconds):
+    """Pages, bytes and time of one extraction, per file format, on /metrics"""
+    labels = {"format": content_type}
+    increment_counter("extraction_pages_total", labels, pages)
+    increment_counter("extraction_bytes_total", labels, size_bytes)
+    observe_histogram("extraction_seconds", labels, seconds)
+def extract_pdf_pages(pdf_bytes):
+    """Text of each PDF page up to PDF_MAX_PAGES, plus the document's total page count.
+    Large documents are split into page ranges and extracted in worker processes."""
+    import fitz
+    import pdf_extract
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+        total_pages = pdf_doc.page_count
+        page_limit = min(total_pages, PDF_MAX_PAGES)
+        if page_limit < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS < 2:
+            return [pdf_doc[page_no].get_text() for page_no in range(page_limit)], total_pages
+    step = -(-page_limit // PDF_EXTRACT_WORKERS)
+    pool = get_pdf_extract_pool()
+    futures = [pool.submit(pdf_extract.extract_page_range, pdf_bytes, start, min(start + step, page_limit))
+               for start in range(0, page_limit, step)]
+    return [text for future in futures for text in future.result()], total_pages
 def extract_text_from_file(uploaded_file):
-    """Extract text content from various file formats"""
+    """Extract text content from various file formats.
+    Returns (text, content_type, stats); PDF pages are separated by form feeds."""
     file_type = uploaded_file.type
-    file_content = uploaded_file.read()   
+    file_content = uploaded_file.read()
+    started = time.perf_counter()
+    stats = {"pages": 1, "total_pages": 1, "bytes": len(file_content)}
+    def finish(text, content_type):
+        stats["seconds"] = time.perf_counter() - started
+        seconds = stats["seconds"] or 1e-9
+        stats["pages_per_sec"] = stats["pages"] / seconds
+        stats["mb_per_sec"] = stats["bytes"] / 1e6 / seconds
+        record_extraction_throughput(content_type, stats["pages"], stats["bytes"], stats["seconds"])
+        return text, content_type, stats
     try:
         if file_type == "text/plain":
-            return file_content.decode('utf-8'), "text"
+            return finish(file_content.decode('utf-8'), "text")
         elif file_type == "application/pdf":
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".pdf") as tmp:
-                tmp.write(file_content)
-                tmp_path = tmp.name
             try:
-                pdf_doc = fitz.open(tmp_path)
-                full_text = ""
-                for page in pdf_doc:
-                    full_text += page.get_text()
-                pdf_doc.close()
-                return full_text, "pdf"
+                pages, total_pages = extract_pdf_pages(file_content)
+                stats["pages"], stats["total_pages"] = len(pages), total_pages
+                return finish("\f".join(pages), "pdf")
             except Exception as e:
-                return f"Error reading PDF: {str(e)}", "pdf"
-            finally:
-                os.remove(tmp_path)
+                return f"Error reading PDF: {str(e)}", "pdf", stats
         elif file_type in ["application/vnd.openxmlformats-officedocument.wordprocessingml.document", "application/msword"]:
-            with tempfile.NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-                tmp.write(file_content)
-                tmp_path = tmp.name
             try:
-                doc = Document(tmp_path)
-                full_text = "\n".join([para.text for para in doc.paragraphs])
-                return full_text, "word"
+                from docx import Document
+                doc = Document(io.BytesIO(file_content))
+                return finish("\n".join(para.text for para in doc.paragraphs), "word")
             except Exception as e:
-                return f"Error reading Word document: {str(e)}", "word"
-            finally:
-                os.remove(tmp_path)
+                return f"Error reading Word document: {str(e)}", "word", stats
         elif file_type == "text/csv":
-            return file_content.decode('utf-8'), "csv"
+            return finish(file_content.decode('utf-8'), "csv")
         elif file_type == "application/json":
-            return file_content.decode('utf-8'), "json"
+            return finish(file_content.decode('utf-8'), "json")
         elif file_type == "text/x-python":
-            return file_content.decode('utf-8'), "python"
+            return finish(file_content.decode('utf-8'), "python")
         elif file_type == "text/markdown":
-            return file_content.decode('utf-8'), "markdown"
+            return finish(file_content.decode('utf-8'), "markdown")
         else:
             try:
-                return file_content.decode('utf-8'), "unknown"
+                return finish(file_content.decode('utf-8'), "unknown")
             except UnicodeDecodeError:
-                return "Binary file format not supported. Please use text-based files.", "binary"               
+                return "Binary file format not supported. Please use text-based files.", "binary", stats
     except Exception as e:
-        return f"Error extracting content: {str(e)}", "error"
-def get_student_data(roll_no):
-    """Fetches student data from the pre_assessment table."""
-    conn = get_db_connection()
-    if conn is None:
-        return {}
-    try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)
-        cursor.execute("SELECT * FROM pre_assessment WHERE roll_no = %s", (roll_no,))
-        student_data = cursor.fetchone()
-        cursor.close()
-        conn.close()
-        return student_data if student_data else {}
-    except psycopg2.Error as e:
-        st.error(f"Error fetching student data: {e}")
-        if conn:
-            conn.close()
-        return {}
+        return f"Error extracting content: {str(e)}", "error", stats
 def file_upload_section():
     st.header("📁 File Upload & Analysis")
 
@@ -269,8 +1337,8 @@ def file_upload_section():
         st.session_state.generated_summary = ""
     if 'generated_video_script' not in st.session_state:
         st.session_state.generated_video_script = ""
-    if 'current_video_id' not in st.session_state:
-        st.session_state.current_video_id = None
+    if 'current_video_job_id' not in st.session_state:
+        st.session_state.current_video_job_id = None
 
     uploaded_file = st.file_uploader(
         "Choose a file to upload and analyze",
@@ -288,17 +1356,37 @@ def file_upload_section():
            st.button("Analyze File", key="analyze_new_file"):
 
             with st.spinner("Processing file and generating summary..."):
-                text_content, content_type = extract_text_from_file(uploaded_file)
-
-                if "Error" in text_content or "not implemented" in text_content:
-                    st.error(text_content)
-                    return
-
-                summary = summarize_file_content(text_content, content_type)
-                uploaded_file.seek(0)
-                file_content = uploaded_file.read()
+                file_content = uploaded_file.getvalue()
+                file_sha256 = hashlib.sha256(file_content).hexdigest()
+                # Identical bytes already analyzed for any student: only the personalized script is regenerated
+                analysis = load_file_analysis(file_sha256)
+                if analysis:
+                    content_type, summary = analysis["content_type"], analysis["file_summary"]
+                    reuse_stats = get_file_analysis_stats()
+                    analysis_note = (f"♻️ Reused the analysis of an identical upload, skipping {analysis['summary_llm_calls']} "
+                                     f"LLM call(s) ({reuse_stats['avoided_llm_calls'] + analysis['summary_llm_calls']} "
+                                     "avoided across all uploads so far).")
+                else:
+                    text_content, content_type, extract_stats = extract_text_from_file(uploaded_file)
+
+                    if "Error" in text_content or "not implemented" in text_content:
+                        st.error(text_content)
+                        return
+                    if extract_stats["pages"] < extract_stats["total_pages"]:
+                        st.warning(f"⚠️ Only the first {extract_stats['pages']} of {extract_stats['total_pages']} pages were read.")
+                    analysis_note = (f"Extracted {extract_stats['pages']} page(s) in {extract_stats['seconds']:.2f}s "
+                                     f"({extract_stats['pages_per_sec']:.1f} pages/s, {extract_stats['mb_per_sec']:.2f} MB/s)")
+
+                    summary_progress = st.progress(0.0, text="Summarizing...")
+                    summary_stats = {}
+                    summary = summarize_file_content(
+                        text_content, content_type,
+                        progress=lambda done, total: summary_progress.progress(done / total, text=f"Summarized {done} of {total} sections"),
+                        stats=summary_stats
+                    )
+                    summary_progress.empty()
 
-                student = get_student_data(st.session_state.roll_no)
+                student = get_student_data(st.session_state.roll_no, include_content=False) or {}
                 domain = student.get("domain", "Data Science")
                 present_domain = student.get("present_domain", "business domain")
                 interested_field = student.get("interested_field", "their field")
@@ -309,11 +1397,14 @@ def file_upload_section():
                         summary,
                         present_domain,
                         interested_field,
-                        student_name
+                        student_name,
+                        stream=True
                     )
 
                 if save_file_data(st.session_state.roll_no, uploaded_file.name,
-                                uploaded_file.type, file_content, summary):
+                                uploaded_file.type, file_content, summary, reused_analysis=bool(analysis)):
+                    if not analysis and not summary.startswith("Summary generation failed"):
+                        save_file_analysis(file_sha256, content_type, text_content, summary, summary_stats["llm_calls"])
                     st.session_state.generated_summary = summary
                     st.session_state.generated_video_script = video_output
                     st.session_state.uploaded_file_info = {
@@ -321,8 +1412,9 @@ def file_upload_section():
                         "type": uploaded_file.type,
                         "content_type": content_type
                     }
+                    st.session_state.file_analysis_note = analysis_note
                     st.session_state.file_analyzed = True
-                    st.session_state.current_video_id = None
+                    st.session_state.current_video_job_id = None
                     st.success("✅ File uploaded and analyzed successfully!")
                     st.rerun()
                 else:
@@ -330,6 +1422,8 @@ def file_upload_section():
     
     if st.session_state.file_analyzed and st.session_state.generated_summary and st.session_state.generated_video_script:
         st.markdown("### 📋 File Summary")
+        if st.session_state.get("file_analysis_note"):
+            st.caption(st.session_state.file_analysis_note)
         st.markdown(st.session_state.generated_summary)
 
         st.markdown("### 🎬 Video Prompt & Script")
@@ -370,75 +1464,14 @@ def file_upload_section():
                 st.error("Could not extract a script from the generated content.")
             else:
                 with st.spinner("Sending script to video generator..."):
-                    create_response = create_tavus_video(TAVUS_API_KEY, script_text)
-
-                    if create_response and create_response.get("video_id"):
-                        video_id = create_response["video_id"]
-                        st.session_state.current_video_id = video_id
-                        st.success(f"✅ Video generation started! Video ID: `{video_id}`")
-                        st.write("⏳ Waiting for video to be ready... This can take a few minutes.")
-
-                        video_url = None
-                        max_attempts = 60
-                        
-                        for attempt in range(max_attempts):
-                            status_response = check_tavus_video_status(TAVUS_API_KEY, video_id)
-                            
-                            if status_response and 'status' in status_response:
-                                status = status_response.get("status")
-                                st.info(f"Video status: '{status}' (Attempt {attempt + 1}/{max_attempts})")
-
-                                # MODIFIED: Check for both 'completed' and 'ready' statuses
-                                if status == "completed" or status == "ready":
-                                    video_url = status_response.get("download_url")
-                                    if video_url: # Ensure download_url is actually present
-                                        st.success("🎉 Your video is ready!")
-                                        st.video(video_url)
-                                        break
-                                    else:
-                                        # If status is 'ready'/'completed' but no URL, wait for a few more attempts
-                                        st.warning("Video status is ready, but download URL not yet available. Waiting...")
-                                        if attempt == max_attempts - 1: # If last attempt and still no URL
-                                            st.error("Video is ready but download URL did not become available.")
-                                            break
-                                        time.sleep(5) # Give it a moment to appear
-                                elif status == "failed":
-                                    error_message = status_response.get('error', 'Unknown error')
-                                    st.error(f"🚫 Video creation failed: {error_message}")
-                                    break
-                            else:
-                                st.warning("Could not retrieve video status. Will retry...")
-
-                            time.sleep(5)
-
-                        if not video_url: # If loop finished without getting video_url
-                            st.warning("⏰ Video is still processing or failed.")
-                            if st.session_state.get('current_video_id'):
-                                if st.button("Manually Check Video Status", key="manual_check_status_button_action"):
-                                    st.info(f"Checking status for Video ID: `{st.session_state.current_video_id}`...")
-                                    manual_status_response = check_tavus_video_status(TAVUS_API_KEY, st.session_state.current_video_id)
-                                    if manual_status_response and 'status' in manual_status_response:
-                                        manual_status = manual_status_response.get("status")
-                                        st.write(f"**Current Video Status:** `{manual_status}`")
-                                        if manual_status == "completed" or manual_status == "ready": # Also check for 'ready' here
-                                            manual_video_url = manual_status_response.get("download_url")
-                                            if manual_video_url:
-                                                st.success("🎉 Video is now ready!")
-                                                st.video(manual_video_url)
-                                            else:
-                                                st.warning("Video is ready but download URL not yet available. Please check Tavus dashboard.")
-                                        elif manual_status == "failed":
-                                            st.error(f"🚫 Video creation failed: {manual_status_response.get('error', 'Unknown error')}")
-                                        else:
-                                            st.info("Video is still processing.")
-                                    else:
-                                        st.error("Could not retrieve manual video status. Please try again or check Tavus dashboard.")
-                                    
-                                    st.markdown(f"**Tavus Dashboard (if applicable):** [Tavus](https://tavus.com/)")
-                    else:
-                        error_msg = create_response.get("error", "Unknown error from API") if create_response else "No response from API"
-                        st.error(f"🚫 Failed to start video creation: {error_msg}")
-def generate_video_script_from_course_profile(course_text, present_domain, interested_field, student_name="the learner"):
+                    job_id = enqueue_video_job(st.session_state.roll_no, "upload", script_text)
+                if job_id:
+                    st.session_state.current_video_job_id = job_id
+                    st.success("✅ Video generation started!")
+
+        if st.session_state.current_video_job_id:
+            render_video_job(st.session_state.current_video_job_id)
+def generate_video_script_from_course_profile(course_text, present_domain, interested_field, student_name="the learner", stream=False):
     prompt = f"""
 🎬 You are an expert educational scriptwriter for animated learning videos.
 
@@ -471,219 +1504,515 @@ Step-by-step narration, include friendly transitions, domain-specific analogies,
 """
     model = get_super_agent_model()
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        if stream:
+            return st.write_stream(stream_llm_text(model, prompt, "video_script")).strip()
+        return generate_llm_text(model, prompt, "video_script").strip()
     except Exception as e:
         return f"Error generating video script from course: {e}"
-def create_tables():
-    """Create database tables"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
-    try:
-        cursor = conn.cursor()        
-        create_pre_assessment_query = """
-        CREATE TABLE IF NOT EXISTS pre_assessment (
-            roll_no VARCHAR(20) PRIMARY KEY,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            name VARCHAR(255) NOT NULL,
-            domain VARCHAR(255) NOT NULL,
-            present_domain VARCHAR(255),
-            interested_field VARCHAR(255),
-            qualification VARCHAR(255),
-            years_experience INTEGER,
-            preferred_difficulty VARCHAR(50),
-            formal_training VARCHAR(10),
-            hours_per_day INTEGER DEFAULT 3,
-            weeks INTEGER DEFAULT 4,
-            knowledge_scale INTEGER,
-            current_week_no INTEGER DEFAULT 1,
-            cognitive_score INTEGER DEFAULT 0,
-            cognitive_iq INTEGER DEFAULT 0,
-            domain_score INTEGER DEFAULT 0,
-            domain_iq INTEGER DEFAULT 0,
-            viva_score INTEGER DEFAULT 0,
-            viva_response TEXT DEFAULT '',
-            course_configured BOOLEAN DEFAULT FALSE
-        );"""            
-        create_week_quiz_query = """
-        CREATE TABLE IF NOT EXISTS week_quiz (
+def migrate_base_schema(cursor):
+    """Migration 1: the tables the app started with, before any numbered migration"""
+    create_pre_assessment_query = """
+    CREATE TABLE IF NOT EXISTS pre_assessment (
+        roll_no VARCHAR(20) PRIMARY KEY,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        name VARCHAR(255) NOT NULL,
+        domain VARCHAR(255) NOT NULL,
+        present_domain VARCHAR(255),
+        interested_field VARCHAR(255),
+        qualification VARCHAR(255),
+        years_experience INTEGER,
+        preferred_difficulty VARCHAR(50),
+        formal_training VARCHAR(10),
+        hours_per_day INTEGER DEFAULT 3,
+        weeks INTEGER DEFAULT 4,
+        knowledge_scale INTEGER,
+        current_week_no INTEGER DEFAULT 1,
+        cognitive_score INTEGER DEFAULT 0,
+        cognitive_iq INTEGER DEFAULT 0,
+        domain_score INTEGER DEFAULT 0,
+        domain_iq INTEGER DEFAULT 0,
+        viva_score INTEGER DEFAULT 0,
+        viva_response TEXT DEFAULT '',
+        course_configured BOOLEAN DEFAULT FALSE
+    );"""            
+    create_week_quiz_query = """
+    CREATE TABLE IF NOT EXISTS week_quiz (
+        id SERIAL PRIMARY KEY,
+        roll_no VARCHAR(20) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
+        week_no INTEGER NOT NULL,
+        week_quiz_score INTEGER DEFAULT 0,
+        week_quiz_iq INTEGER DEFAULT 0,
+        strong_areas TEXT,
+        weak_areas TEXT,
+        analysis TEXT,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(roll_no, week_no)
+    );"""       
+    create_course_content_query = """
+    CREATE TABLE IF NOT EXISTS course_content (
+        id SERIAL PRIMARY KEY,
+        roll_no VARCHAR(20) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
+        week_no INTEGER NOT NULL,
+        course_content TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE(roll_no, week_no)
+    );"""        
+    create_overall_performance_query = """
+    CREATE TABLE IF NOT EXISTS overall_performance (
+        roll_no VARCHAR(20) PRIMARY KEY REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
+        topics_excellented TEXT,
+        outcome_of_course TEXT,
+        student_progress TEXT,
+        last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );"""
+    create_data_query = """
+    CREATE TABLE IF NOT EXISTS data (
+        id SERIAL PRIMARY KEY,
+        roll_no VARCHAR(20) NOT NULL,
+        file_name VARCHAR(255) NOT NULL,
+        file_type VARCHAR(50) NOT NULL,
+        file_data TEXT NOT NULL,
+        file_summary TEXT,
+        uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        FOREIGN KEY (roll_no) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE
+    );"""       
+    create_mini_quiz_query = """
+    CREATE TABLE IF NOT EXISTS mini_quiz (
+        id SERIAL PRIMARY KEY,
+        roll_no VARCHAR(20) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
+        week_no INTEGER NOT NULL,
+        topic_no INTEGER NOT NULL,
+        topic_name TEXT NOT NULL,
+        quiz_score INTEGER DEFAULT 0,
+        date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        UNIQUE (roll_no, week_no, topic_no)
+    );"""
+    cursor.execute(create_pre_assessment_query)
+    cursor.execute(create_mini_quiz_query)
+    cursor.execute(create_week_quiz_query)
+    cursor.execute(create_course_content_query)
+    cursor.execute(create_overall_performance_query)
+    cursor.execute(create_data_query)  
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS agent_data (
+        roll_no VARCHAR(20) PRIMARY KEY REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
+        pre_assessment JSONB,
+        mini_quiz JSONB,
+        weekly_quiz JSONB,
+        overall_performance JSONB,
+        course_fetch TEXT,
+        trend_fetch TEXT
+    );
+    """)
+    cursor.execute("""
+    CREATE TABLE IF NOT EXISTS user_login (
+        id SERIAL PRIMARY KEY,
+        email VARCHAR(255) UNIQUE NOT NULL,
+        password VARCHAR(255) NOT NULL,
+        total_logins INTEGER DEFAULT 0,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        last_login TIMESTAMP
+    );""")
+# Ordered schema migrations: (version, description, SQL statements or a function taking a cursor).
+# Append new entries; never edit one that has shipped.
+MIGRATIONS = [
+    (1, "base schema", migrate_base_schema),
+    (2, "llm response cache", [
+        """
+        CREATE TABLE IF NOT EXISTS llm_cache (
+            cache_key CHAR(64) PRIMARY KEY,
+            model_name VARCHAR(100) NOT NULL,
+            call_site VARCHAR(50) NOT NULL,
+            response TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            expires_at TIMESTAMP NOT NULL
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_llm_cache_expires_at ON llm_cache (expires_at)",
+    ]),
+    (3, "question bank", [
+        """
+        CREATE TABLE IF NOT EXISTS question_bank (
             id SERIAL PRIMARY KEY,
+            domain VARCHAR(255) NOT NULL,
+            section_type VARCHAR(20) NOT NULL,
+            level INTEGER NOT NULL,
+            question_type VARCHAR(30) NOT NULL,
+            language VARCHAR(30) NOT NULL,
+            question JSONB NOT NULL,
+            question_hash CHAR(64) NOT NULL UNIQUE,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_question_bank_bucket
+        ON question_bank (domain, section_type, level, question_type, language)
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS question_bank_served (
             roll_no VARCHAR(20) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
-            week_no INTEGER NOT NULL,
-            week_quiz_score INTEGER DEFAULT 0,
-            week_quiz_iq INTEGER DEFAULT 0,
-            strong_areas TEXT,
-            weak_areas TEXT,
-            analysis TEXT,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(roll_no, week_no)
-        );"""       
-        create_course_content_query = """
-        CREATE TABLE IF NOT EXISTS course_content (
-            id SERIAL PRIMARY KEY,
+            question_id INTEGER REFERENCES question_bank(id) ON DELETE CASCADE,
+            served_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            PRIMARY KEY (roll_no, question_id)
+        )
+        """,
+    ]),
+    (4, "agent input fingerprints", [
+        """
+        ALTER TABLE agent_data
+            ADD COLUMN IF NOT EXISTS input_hashes JSONB DEFAULT '{}'::jsonb,
+            ADD COLUMN IF NOT EXISTS dirty BOOLEAN DEFAULT TRUE
+        """,
+    ]),
+    (5, "stored mini quizzes", [
+        """
+        CREATE TABLE IF NOT EXISTS topic_mini_quiz (
             roll_no VARCHAR(20) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
             week_no INTEGER NOT NULL,
-            course_content TEXT,
+            topic_no INTEGER NOT NULL,
+            topic_name TEXT NOT NULL,
+            question JSONB NOT NULL,
             created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE(roll_no, week_no)
-        );"""        
-        create_overall_performance_query = """
-        CREATE TABLE IF NOT EXISTS overall_performance (
-            roll_no VARCHAR(20) PRIMARY KEY REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
-            topics_excellented TEXT,
-            outcome_of_course TEXT,
-            student_progress TEXT,
-            last_updated TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-        );"""
-        create_data_query = """
-        CREATE TABLE IF NOT EXISTS data (
-            id SERIAL PRIMARY KEY,
-            roll_no VARCHAR(20) NOT NULL,
-            file_name VARCHAR(255) NOT NULL,
-            file_type VARCHAR(50) NOT NULL,
-            file_data TEXT NOT NULL,
-            file_summary TEXT,
-            uploaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            FOREIGN KEY (roll_no) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE
-        );"""       
-        create_mini_quiz_query = """
-        CREATE TABLE IF NOT EXISTS mini_quiz (
+            PRIMARY KEY (roll_no, week_no, topic_no)
+        )
+        """,
+    ]),
+    (6, "video jobs", [
+        """
+        CREATE TABLE IF NOT EXISTS video_jobs (
             id SERIAL PRIMARY KEY,
             roll_no VARCHAR(20) REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
-            week_no INTEGER NOT NULL,
-            topic_no INTEGER NOT NULL,
-            topic_name TEXT NOT NULL,
-            quiz_score INTEGER DEFAULT 0,
-            date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            UNIQUE (roll_no, week_no, topic_no)
-        );"""
-        cursor.execute(create_pre_assessment_query)
-        cursor.execute(create_mini_quiz_query)
-        cursor.execute(create_week_quiz_query)
-        cursor.execute(create_course_content_query)
-        cursor.execute(create_overall_performance_query)
-        cursor.execute(create_data_query)  
-        cursor.execute("""
-        CREATE TABLE IF NOT EXISTS agent_data (
-            roll_no VARCHAR(20) PRIMARY KEY REFERENCES pre_assessment(roll_no) ON DELETE CASCADE,
-            pre_assessment JSONB,
-            mini_quiz JSONB,
-            weekly_quiz JSONB,
-            overall_performance JSONB,
-            course_fetch TEXT,
-            trend_fetch TEXT
-        );
-        """)
-        conn.commit()
-        cursor.close()
-        conn.close()
+            source VARCHAR(20) NOT NULL,
+            video_id VARCHAR(100) NOT NULL,
+            status VARCHAR(30) NOT NULL DEFAULT 'queued',
+            download_url TEXT,
+            error TEXT,
+            attempts INTEGER DEFAULT 0,
+            next_poll_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE INDEX IF NOT EXISTS idx_video_jobs_due ON video_jobs (next_poll_at)
+        WHERE status NOT IN ('ready', 'failed', 'expired')
+        """,
+    ]),
+    (7, "deduplicated file blobs", [
+        """
+        CREATE TABLE IF NOT EXISTS file_blobs (
+            sha256 CHAR(64) PRIMARY KEY,
+            content BYTEA NOT NULL,
+            size_bytes BIGINT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        # Uploads now live in file_blobs; file_data is only kept for rows awaiting --migrate-file-blobs
+        "ALTER TABLE data ADD COLUMN IF NOT EXISTS blob_sha256 CHAR(64) REFERENCES file_blobs(sha256)",
+        "ALTER TABLE data ALTER COLUMN file_data DROP NOT NULL",
+    ]),
+    (8, "stored file analysis", [
+        """
+        CREATE TABLE IF NOT EXISTS file_analysis (
+            sha256 CHAR(64) PRIMARY KEY REFERENCES file_blobs(sha256) ON DELETE CASCADE,
+            content_type VARCHAR(20) NOT NULL,
+            text_content TEXT NOT NULL,
+            file_summary TEXT NOT NULL,
+            summary_llm_calls INTEGER NOT NULL,
+            reuse_count INTEGER DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+    ]),
+    (9, "roll number counters", [
+        """
+        CREATE TABLE IF NOT EXISTS roll_no_counters (
+            year SMALLINT NOT NULL,
+            course_code VARCHAR(4) NOT NULL,
+            branch VARCHAR(10) NOT NULL,
+            last_seq INTEGER NOT NULL,
+            PRIMARY KEY (year, course_code, branch)
+        )
+        """,
+    ]),
+    (10, "secondary indexes", [
+        # generate_roll_no-style prefix lookups (roll_no LIKE '26DP%CSE')
+        "CREATE INDEX IF NOT EXISTS idx_pre_assessment_roll_no_pattern ON pre_assessment (roll_no varchar_pattern_ops)",
+        "CREATE INDEX IF NOT EXISTS idx_data_roll_no ON data (roll_no, uploaded_at)",
+        "CREATE INDEX IF NOT EXISTS idx_data_blob_sha256 ON data (blob_sha256)",
+        "CREATE INDEX IF NOT EXISTS idx_video_jobs_roll_no ON video_jobs (roll_no)",
+        "CREATE INDEX IF NOT EXISTS idx_question_bank_served_question ON question_bank_served (question_id)",
+    ]),
+    (11, "metrics snapshots", [
+        """
+        CREATE TABLE IF NOT EXISTS app_metrics (
+            id BIGSERIAL PRIMARY KEY,
+            recorded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            process_id INTEGER NOT NULL,
+            metric VARCHAR(100) NOT NULL,
+            labels JSONB NOT NULL,
+            count DOUBLE PRECISION NOT NULL,
+            sum DOUBLE PRECISION
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_app_metrics_metric_time ON app_metrics (metric, recorded_at)",
+    ]),
+]
+SCHEMA_MIGRATION_LOCK_ID = 72174101  # pg_advisory_lock key shared by every app process
+def run_migrations():
+    """Apply pending MIGRATIONS under an advisory lock; returns the schema version.
+    Each migration commits together with its schema_migrations row."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT pg_advisory_lock(%s)", (SCHEMA_MIGRATION_LOCK_ID,))
+        try:
+            cursor.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                description TEXT NOT NULL,
+                applied_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            );
+            """)
+            cursor.execute("SELECT version FROM schema_migrations")
+            applied = {row[0] for row in cursor.fetchall()}
+            conn.commit()
+            for version, description, migration in MIGRATIONS:
+                if version in applied:
+                    continue
+                if callable(migration):
+                    migration(cursor)
+                else:
+                    for statement in migration:
+                        cursor.execute(statement)
+                cursor.execute("INSERT INTO schema_migrations (version, description) VALUES (%s, %s)",
+                               (version, description))
+                conn.commit()
+                applied.add(version)
+        finally:
+            conn.rollback()
+            cursor.execute("SELECT pg_advisory_unlock(%s)", (SCHEMA_MIGRATION_LOCK_ID,))
+            conn.commit()
+            cursor.close()
+    return max(applied, default=0)
+@st.cache_resource
+def ensure_schema():
+    """Run the migrations once per process; a failure is not cached, so the next session retries"""
+    return run_migrations()
+def create_tables():
+    """Create database tables"""
+    try:
+        ensure_schema()
         return True
     except psycopg2.Error as e:
         st.error(f"Error creating tables: {e}")
-        if conn:
-            conn.close()
         return False
-def run_agent_pre_assessment(roll_no):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT * FROM pre_assessment WHERE roll_no = %s", (roll_no,))
-    data = cursor.fetchone()
-    if data:
-        data_serializable = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in data.items()}
-        prompt = f"Summarize this student's background:\n{json.dumps(data_serializable, indent=2)}"
-        summary = get_agent1_model().generate_content(prompt).text.strip()
+def agent_input_hash(payload):
+    """Fingerprint of the serialized input an agent would send to Gemini"""
+    return hashlib.sha256(json.dumps(payload, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+def run_agent_pre_assessment(roll_no, known_hash=None):
+    """Summarise the student's background.
+    Returns (agent_data.pre_assessment value, input hash); the value is None when
+    there is no data or the input hash matches known_hash."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT * FROM pre_assessment WHERE roll_no = %s", (roll_no,))
+        data = cursor.fetchone()
+        cursor.close()
+    if not data:
+        return None, None
+    data_serializable = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in data.items()}
+    input_hash = agent_input_hash(data_serializable)
+    if input_hash == known_hash:
+        return None, input_hash
+    prompt = f"Summarize this student's background:\n{json.dumps(data_serializable, indent=2)}"
+    summary = call_gemini(get_agent1_model(), prompt, "agent_pre_assessment").strip()
+    return json.dumps({"summary": summary}), input_hash
+def run_agent_mini_quiz(roll_no, known_hash=None):
+    """Analyse mini quiz scores; returns (agent_data.mini_quiz value, input hash)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT week_no, topic_name, quiz_score FROM mini_quiz WHERE roll_no = %s ORDER BY week_no, topic_no", (roll_no,))
+        data = cursor.fetchall()
+        cursor.close()
+    if not data:
+        return None, None
+    data_serializable = []
+    for row in data:
+        fixed_row = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row.items()}
+        data_serializable.append(fixed_row)
+    input_hash = agent_input_hash(data_serializable)
+    if input_hash == known_hash:
+        return None, input_hash
+    prompt = f"""
+    Analyze student quiz scores:\n{json.dumps(data_serializable, indent=2)}
+    """
+    model = get_agent2_model()
+    summary = call_gemini(model, prompt, "agent_mini_quiz").strip()
+    return json.dumps({"summary": summary}), input_hash
+def run_agent_weekly_quiz(roll_no, known_hash=None):
+    """Identify weekly quiz trends; returns (agent_data.weekly_quiz value, input hash)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT * FROM week_quiz WHERE roll_no = %s ORDER BY week_no", (roll_no,))
+        data = cursor.fetchall()
+        cursor.close()
+    if not data:
+        return None, None
+    data_serializable = []
+    for row in data:
+        fixed_row = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row.items()}
+        data_serializable.append(fixed_row)
+    input_hash = agent_input_hash(data_serializable)
+    if input_hash == known_hash:
+        return None, input_hash
+    prompt = f"""
+    Identify weekly quiz trends:\n{json.dumps(data_serializable, indent=2)}
+    """
+    model = get_agent3_model()
+    summary = call_gemini(model, prompt, "agent_weekly_quiz").strip()
+    return json.dumps({"summary": summary}), input_hash
+def run_agent_overall_performance(roll_no, known_hash=None):
+    """Two-line performance summary; returns (agent_data.overall_performance value, input hash)"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        # last_updated is left out: it changes on every recompute and would defeat the fingerprint
         cursor.execute("""
-            INSERT INTO agent_data (roll_no, pre_assessment)
-            VALUES (%s, %s)
-            ON CONFLICT (roll_no) DO UPDATE SET pre_assessment = EXCLUDED.pre_assessment
-        """, (roll_no, json.dumps({"summary": summary})))
-        conn.commit()
-    cursor.close()
-    conn.close()
-def run_agent_mini_quiz(roll_no):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT week_no, topic_name, quiz_score FROM mini_quiz WHERE roll_no = %s", (roll_no,))
-    data = cursor.fetchall()
-    if data:
-        data_serializable = []
-        for row in data:
-            fixed_row = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row.items()}
-            data_serializable.append(fixed_row)
-        prompt = f"""
-        Analyze student quiz scores:\n{json.dumps(data_serializable, indent=2)}
-        """
-        model = get_agent2_model()
-        summary = model.generate_content(prompt).text.strip()
-        cursor.execute("UPDATE agent_data SET mini_quiz = %s WHERE roll_no = %s", (json.dumps({"summary": summary}), roll_no))
-        conn.commit()
-    cursor.close()
-    conn.close()
-def run_agent_weekly_quiz(roll_no):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT * FROM week_quiz WHERE roll_no = %s", (roll_no,))
-    data = cursor.fetchall()
-    if data:
-        data_serializable = []
-        for row in data:
-            fixed_row = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in row.items()}
-            data_serializable.append(fixed_row)
-        prompt = f"""
-        Identify weekly quiz trends:\n{json.dumps(data_serializable, indent=2)}
-        """
-        model = get_agent3_model()
-        summary = model.generate_content(prompt).text.strip()
-        cursor.execute("UPDATE agent_data SET weekly_quiz = %s WHERE roll_no = %s", (json.dumps({"summary": summary}), roll_no))
-        conn.commit()
-    cursor.close()
-    conn.close()
-def run_agent_overall_performance(roll_no):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT * FROM overall_performance WHERE roll_no = %s", (roll_no,))
-    data = cursor.fetchone()
-    if data:
-        data_serializable = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in data.items()}
-        prompt = f"""
-        Summarize this student's overall performance in 2 lines:
-
-        {json.dumps(data_serializable, indent=2)}
-        """
-        model = get_agent4_model()
-        summary = model.generate_content(prompt).text.strip()
-        cursor.execute("UPDATE agent_data SET overall_performance = %s WHERE roll_no = %s", (json.dumps({"summary": summary}), roll_no))
-        conn.commit()
-    cursor.close()
-    conn.close()
-def run_agent_course_fetch(roll_no):
+            SELECT roll_no, topics_excellented, outcome_of_course, student_progress
+            FROM overall_performance WHERE roll_no = %s
+        """, (roll_no,))
+        data = cursor.fetchone()
+        cursor.close()
+    if not data:
+        return None, None
+    data_serializable = {k: (v.isoformat() if isinstance(v, datetime) else v) for k, v in data.items()}
+    input_hash = agent_input_hash(data_serializable)
+    if input_hash == known_hash:
+        return None, input_hash
+    prompt = f"""
+    Summarize this student's overall performance in 2 lines:
+
+    {json.dumps(data_serializable, indent=2)}
+    """
+    model = get_agent4_model()
+    summary = call_gemini(model, prompt, "agent_overall_performance").strip()
+    return json.dumps({"summary": summary}), input_hash
+def run_agent_course_fetch(roll_no, known_hash=None):
     course_text = "Python Basics, Functions, OOP, APIs"
     prompt = f"Choose 3 most important topics from:\n{course_text}"
-    summary = get_agent5_model().generate_content(prompt).text.strip()
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE agent_data SET course_fetch = %s WHERE roll_no = %s", (summary, roll_no))
-    conn.commit()
-    cursor.close()
-    conn.close()
-def run_agent_trend_fetch(roll_no):
+    input_hash = agent_input_hash(prompt)
+    if input_hash == known_hash:
+        return None, input_hash
+    return generate_llm_text(get_agent5_model(), prompt, "agent_course_fetch").strip(), input_hash
+def run_agent_trend_fetch(roll_no, known_hash=None):
     trends = "Generative AI, Data Ethics, Prompt Engineering"
     prompt = f"Pick top trends for a beginner course:\n{trends}"
-    summary = get_agent6_model().generate_content(prompt).text.strip()
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    cursor.execute("UPDATE agent_data SET trend_fetch = %s WHERE roll_no = %s", (summary, roll_no))
-    conn.commit()
-    cursor.close()
-    conn.close()
-def run_super_agent_generate_course(roll_no):
-    conn = get_db_connection()
-    cursor = conn.cursor(cursor_factory=RealDictCursor)
-    cursor.execute("SELECT * FROM agent_data WHERE roll_no = %s", (roll_no,))
-    agent_data = cursor.fetchone()
-    cursor.close()
-    conn.close()
+    input_hash = agent_input_hash(prompt)
+    if input_hash == known_hash:
+        return None, input_hash
+    return generate_llm_text(get_agent6_model(), prompt, "agent_trend_fetch").strip(), input_hash
+# agent_data column -> (agent, timeout in seconds)
+BACKGROUND_AGENTS = {
+    "pre_assessment": (run_agent_pre_assessment, 60),
+    "mini_quiz": (run_agent_mini_quiz, 60),
+    "weekly_quiz": (run_agent_weekly_quiz, 60),
+    "overall_performance": (run_agent_overall_performance, 60),
+    "course_fetch": (run_agent_course_fetch, 45),
+    "trend_fetch": (run_agent_trend_fetch, 45)
+}
+@st.cache_resource
+def get_agent_executor():
+    """Shared pool for the section 7 agents; timed-out agents finish here without blocking a rerun"""
+    return ThreadPoolExecutor(max_workers=AGENT_MAX_WORKERS, thread_name_prefix="background-agent")
+def timed_agent_call(agent, roll_no, known_hash):
+    started = time.perf_counter()
+    value, input_hash = agent(roll_no, known_hash)
+    return value, input_hash, time.perf_counter() - started
+def mark_agent_data_dirty(cursor, roll_no):
+    """Flag agent_data for recomputation; call inside the write helper's transaction"""
+    cursor.execute("UPDATE agent_data SET dirty = TRUE WHERE roll_no = %s", (roll_no,))
+def claim_agent_inputs(roll_no):
+    """Clear the dirty flag before the agents run so writes made meanwhile re-flag the row.
+    Returns the stored input hashes, or None when nothing changed since the last run."""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("SELECT dirty, input_hashes FROM agent_data WHERE roll_no = %s FOR UPDATE", (roll_no,))
+        row = cursor.fetchone()
+        if row and not row[0]:
+            cursor.close()
+            return None
+        if row:
+            cursor.execute("UPDATE agent_data SET dirty = FALSE WHERE roll_no = %s", (roll_no,))
+        conn.commit()
+        cursor.close()
+    return (row[1] if row else None) or {}
+def save_agent_results(roll_no, results, input_hashes, still_dirty):
+    """Upsert every agent output and its input hash into agent_data in a single transaction"""
+    columns = [column for column in BACKGROUND_AGENTS if column in results]
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute(f"""
+            INSERT INTO agent_data (roll_no, {"".join(c + ", " for c in columns)}input_hashes, dirty)
+            VALUES (%s, {"".join("%s, " for c in columns)}%s, %s)
+            ON CONFLICT (roll_no) DO UPDATE SET
+                {"".join(f"{c} = EXCLUDED.{c}, " for c in columns)}
+                input_hashes = COALESCE(agent_data.input_hashes, '{{}}'::jsonb) || EXCLUDED.input_hashes,
+                dirty = agent_data.dirty OR EXCLUDED.dirty
+        """, [roll_no] + [results[c] for c in columns] + [json.dumps(input_hashes), still_dirty])
+        conn.commit()
+        cursor.close()
+def run_background_agents(roll_no):
+    """Run the section 7 agents concurrently with per-agent timeouts.
+    Agents whose input fingerprint is unchanged skip their Gemini call, and when no
+    write helper has flagged the student dirty nothing runs at all. Returns a dict
+    with results, failures, skipped, wall_seconds and sequential_seconds (the summed
+    agent time a one-by-one run would have taken)."""
+    report = {"results": {}, "failures": {}, "skipped": [], "wall_seconds": 0.0, "sequential_seconds": 0.0}
+    started = time.perf_counter()
+    known_hashes = claim_agent_inputs(roll_no)
+    if known_hashes is None:
+        report["skipped"] = list(BACKGROUND_AGENTS)
+        return report
+    executor = get_agent_executor()
+    futures = {column: executor.submit(timed_agent_call, agent, roll_no, known_hashes.get(column))
+               for column, (agent, _) in BACKGROUND_AGENTS.items()}
+    input_hashes = {}
+    for column, future in futures.items():
+        timeout = BACKGROUND_AGENTS[column][1]
+        try:
+            value, input_hash, elapsed = future.result(timeout=max(0.0, timeout - (time.perf_counter() - started)))
+            report["sequential_seconds"] += elapsed
+            if value is not None:
+                report["results"][column] = value
+                input_hashes[column] = input_hash
+            elif input_hash is not None:
+                report["skipped"].append(column)
+        except FuturesTimeoutError:
+            future.cancel()
+            report["sequential_seconds"] += timeout
+            report["failures"][column] = f"timed out after {timeout}s"
+        except Exception as e:
+            report["failures"][column] = str(e)
+    try:
+        save_agent_results(roll_no, report["results"], input_hashes, bool(report["failures"]))
+    except psycopg2.Error:
+        # claim_agent_inputs already cleared the flag; set it again so the next visit recomputes
+        try:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                mark_agent_data_dirty(cursor, roll_no)
+                conn.commit()
+                cursor.close()
+        except psycopg2.Error:
+            pass
+        raise
+    report["wall_seconds"] = time.perf_counter() - started
+    return report
+def run_super_agent_generate_course(roll_no, stream=False):
+    with get_db_connection() as conn:
+        cursor = conn.cursor(cursor_factory=RealDictCursor)
+        cursor.execute("SELECT * FROM agent_data WHERE roll_no = %s", (roll_no,))
+        agent_data = cursor.fetchone()
+        cursor.close()
 
     if not agent_data:
         return "No agent data found."
@@ -740,45 +2069,93 @@ If applicable, include tips on open-source tools and automation relevant to thei
 
     model = get_super_agent_model()
     try:
-        response = model.generate_content(prompt)
-        final_course = response.text.strip()
+        if stream:
+            final_course = st.write_stream(stream_llm_text(model, prompt, "super_agent_course")).strip()
+        else:
+            final_course = generate_llm_text(model, prompt, "super_agent_course").strip()
         save_course_content(roll_no, 1, final_course)
         return final_course
     except Exception as e:
         return f"Gemini error: {e}"
-def generate_mini_quiz(topic, domain):
-    quiz_model = get_quiz_model()
-    prompt = f"""Generate 1 mini quiz (MCQ) for the topic: '{topic}' in the {domain} domain.
-Return JSON:
-[{{"question_text": "...", "question_type": "mcq", "options": ["A", "B", "C", "D"], "correct_answer": "The full text of the correct answer", "explanation": "..."}}]"""
+def generate_mini_quizzes(topic_names, domain):
+    """Generate one MCQ per topic in a single structured call; returns {topic_no: quiz}"""
+    quiz_model = get_structured_model(GEMINI_API_KEY_QUIZ, question_schema("mcq", with_topic_no=True))
+    topic_lines = "\n".join(f"{topic_no}. {name}" for topic_no, name in topic_names.items())
+    prompt = f"""Generate 1 mini quiz (MCQ) for each of these {len(topic_names)} topics in the {domain} domain:
+{topic_lines}
+Return a JSON array with one object per topic, using the topic number shown above:
+[{{"topic_no": 1, "question_text": "...", "question_type": "mcq", "options": ["A", "B", "C", "D"], "correct_answer": "The full text of the correct answer", "explanation": "..."}}]"""
     try:
-        response = quiz_model.generate_content(prompt)
-        json_data = json.loads(response.text[response.text.find('['):response.text.rfind(']')+1])
-        return json_data[0]
+        json_data = generate_structured(
+            quiz_model, prompt, "mini_quiz", list,
+            lambda value: any(is_complete_question(dict(q, question_type="mcq"), "mcq") for q in value if isinstance(q, dict))
+        )
     except Exception as e:
-        st.error(f"Failed to generate mini-quiz: {e}")
-        return None
-def save_mini_quiz_result(roll_no, week_no, topic_no, topic_name, quiz_score):
-    conn = get_db_connection()
-    if conn is None:
-        return False
-    try:
+        st.error(f"Failed to generate mini-quizzes: {e}")
+        return {}
+    quizzes = {}
+    for position, quiz in enumerate(json_data):
+        if not isinstance(quiz, dict):
+            continue
+        topic_no = quiz.pop("topic_no", None)
+        if topic_no not in topic_names:
+            topic_no = list(topic_names)[position] if position < len(topic_names) else None
+        quiz["question_type"] = "mcq"
+        if topic_no is not None and is_complete_question(quiz, "mcq"):
+            quizzes[topic_no] = quiz
+    return quizzes
+def load_week_mini_quizzes(roll_no, week_no, topic_names, domain):
+    """Stored mini quizzes for a week, generating any missing topics in one batch.
+    Stored questions are never replaced, so a student always answers the question they saw."""
+    with get_db_connection() as conn:
         cursor = conn.cursor()
         cursor.execute("""
-            INSERT INTO mini_quiz (roll_no, week_no, topic_no, topic_name, quiz_score)
-            VALUES (%s, %s, %s, %s, %s)
-            ON CONFLICT (roll_no, week_no, topic_no)
-            DO UPDATE SET quiz_score = EXCLUDED.quiz_score, date = CURRENT_TIMESTAMP
-        """, (roll_no, week_no, topic_no, topic_name, quiz_score))
-        conn.commit()
+            SELECT topic_no, question FROM topic_mini_quiz
+            WHERE roll_no = %s AND week_no = %s
+        """, (roll_no, week_no))
+        quizzes = {row[0]: row[1] for row in cursor.fetchall()}
         cursor.close()
-        conn.close()
+    missing = {topic_no: name for topic_no, name in topic_names.items() if topic_no not in quizzes}
+    if not missing:
+        return quizzes
+    generated = generate_mini_quizzes(missing, domain)
+    if generated:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            for topic_no, quiz in generated.items():
+                cursor.execute("""
+                    INSERT INTO topic_mini_quiz (roll_no, week_no, topic_no, topic_name, question)
+                    VALUES (%s, %s, %s, %s, %s)
+                    ON CONFLICT (roll_no, week_no, topic_no) DO NOTHING
+                """, (roll_no, week_no, topic_no, missing[topic_no], json.dumps(quiz)))
+            conn.commit()
+            cursor.close()
+        quizzes.update(generated)
+    return quizzes
+def topic_title(topic_content, idx):
+    topic_name_match = re.match(r"Topic\s*\d+:\s*(.*)", topic_content.split('\n')[0])
+    return topic_name_match.group(1).strip() if topic_name_match else f"Topic {idx}"
+def save_mini_quiz_result(roll_no, week_no, topic_no, topic_name, quiz_score):
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO mini_quiz (roll_no, week_no, topic_no, topic_name, quiz_score)
+                VALUES (%s, %s, %s, %s, %s)
+                ON CONFLICT (roll_no, week_no, topic_no)
+                DO UPDATE SET quiz_score = EXCLUDED.quiz_score, date = CURRENT_TIMESTAMP
+            """, (roll_no, week_no, topic_no, topic_name, quiz_score))
+            mark_agent_data_dirty(cursor, roll_no)
+            conn.commit()
+            cursor.close()
         return True
     except Exception as e:
         st.error(f"Error saving mini quiz: {e}")
         return False
-def generate_roll_no(domain, branch="CSE"):
-    """Generate sequential roll number based on domain"""
+def generate_roll_no(cursor, domain, branch="CSE"):
+    """Allocate the next sequential roll number for the domain.
+    Runs on the caller's cursor: the counter row stays locked until the caller's
+    transaction commits, so concurrent registrations never share a number."""
     current_year = datetime.now().year % 100   
     domain_codes = {
         "data science using python": "DP",
@@ -788,85 +2165,71 @@ def generate_roll_no(domain, branch="CSE"):
     } 
     domain_lower = domain.lower()
     course_code = domain_codes.get(domain_lower, "GN")   
-    conn = get_db_connection()
-    if conn:
-        try:
-            cursor = conn.cursor()
-            pattern = f"{current_year}{course_code}%{branch}"
-            cursor.execute("""
-                SELECT roll_no FROM pre_assessment 
-                WHERE roll_no LIKE %s 
-                ORDER BY roll_no DESC LIMIT 1
-            """, (pattern,))
-            result = cursor.fetchone()           
-            if result:
-                last_roll = result[0]
-                seq_part = last_roll.split(course_code)[1][:3]
-                next_seq = int(seq_part) + 1
-            else:
-                next_seq = 1           
-            cursor.close()
-            conn.close()          
-            roll_no = f"{current_year}{course_code}{next_seq:03d}{branch}"
-            return roll_no           
-        except Exception as e:
-            st.error(f"Error generating roll number: {e}")
-            if conn:
-                conn.close()
-            return f"{current_year}{course_code}001{branch}"   
-    return f"{current_year}{course_code}001{branch}"    
+    cursor.execute("""
+        UPDATE roll_no_counters SET last_seq = last_seq + 1
+        WHERE year = %s AND course_code = %s AND branch = %s
+        RETURNING last_seq
+    """, (current_year, course_code, branch))
+    result = cursor.fetchone()
+    if result is None:
+        # First registration for this counter: seed it from roll numbers issued before counters existed
+        cursor.execute("""
+            INSERT INTO roll_no_counters (year, course_code, branch, last_seq)
+            SELECT %s, %s, %s, COALESCE(MAX(SUBSTRING(roll_no FROM %s)::INTEGER), 0) + 1
+            FROM pre_assessment WHERE roll_no LIKE %s
+            ON CONFLICT (year, course_code, branch) DO UPDATE SET last_seq = roll_no_counters.last_seq + 1
+            RETURNING last_seq
+        """, (current_year, course_code, branch,
+              f"^{current_year}{course_code}([0-9]+){branch}$", f"{current_year}{course_code}%{branch}"))
+        result = cursor.fetchone()
+    return f"{current_year}{course_code}{result[0]:03d}{branch}"
 def save_pre_assessment(data):
     """Save pre-assessment data to database"""
-    conn = get_db_connection()
-    if conn is None:
-        return None
     try:
-        roll_no = generate_roll_no(data['domain'])
-        cursor = conn.cursor()       
-        insert_query = """
-        INSERT INTO pre_assessment (
-            roll_no, name, domain, present_domain, interested_field, qualification,
-            years_experience, preferred_difficulty, formal_training,
-            hours_per_day, weeks, knowledge_scale,
-            current_week_no, cognitive_score, cognitive_iq, domain_score, domain_iq
-        ) VALUES (
-            %s, %s, %s, %s, %s, %s,
-            %s, %s, %s,
-            %s, %s, %s,
-            %s, %s, %s, %s, %s
-        )
-        """
-        cursor.execute(insert_query, (
-            roll_no,
-            data.get('name', ''),
-            data.get('domain', ''),
-            data.get('present_domain', ''),
-            data.get('interested_field', ''),
-            data.get('qualification', ''),
-            data.get('years_experience', 0),
-            data.get('preferred_difficulty', 'Medium'),
-            data.get('formal_training', 'No'),
-            data.get('hours_per_day', 3),
-            data.get('weeks', 4),
-            data.get('knowledge_scale', 2),
-            1,
-            data.get('cognitive_score', 0),
-            data.get('cognitive_iq', 0),
-            data.get('domain_score', 0),
-            data.get('domain_iq', 0)
-        ))        
-        cursor.execute("""
-            INSERT INTO overall_performance (roll_no, topics_excellented, outcome_of_course, student_progress)
-            VALUES (%s, %s, %s, %s)
-        """, (roll_no, '', 'Course started', 'Initial assessment completed'))        
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()       
+            roll_no = generate_roll_no(cursor, data['domain'])
+            insert_query = """
+            INSERT INTO pre_assessment (
+                roll_no, name, domain, present_domain, interested_field, qualification,
+                years_experience, preferred_difficulty, formal_training,
+                hours_per_day, weeks, knowledge_scale,
+                current_week_no, cognitive_score, cognitive_iq, domain_score, domain_iq
+            ) VALUES (
+                %s, %s, %s, %s, %s, %s,
+                %s, %s, %s,
+                %s, %s, %s,
+                %s, %s, %s, %s, %s
+            )
+            """
+            cursor.execute(insert_query, (
+                roll_no,
+                data.get('name', ''),
+                data.get('domain', ''),
+                data.get('present_domain', ''),
+                data.get('interested_field', ''),
+                data.get('qualification', ''),
+                data.get('years_experience', 0),
+                data.get('preferred_difficulty', 'Medium'),
+                data.get('formal_training', 'No'),
+                data.get('hours_per_day', 3),
+                data.get('weeks', 4),
+                data.get('knowledge_scale', 2),
+                1,
+                data.get('cognitive_score', 0),
+                data.get('cognitive_iq', 0),
+                data.get('domain_score', 0),
+                data.get('domain_iq', 0)
+            ))        
+            cursor.execute("""
+                INSERT INTO overall_performance (roll_no, topics_excellented, outcome_of_course, student_progress)
+                VALUES (%s, %s, %s, %s)
+            """, (roll_no, '', 'Course started', 'Initial assessment completed'))        
+            conn.commit()
+            cursor.close()
         return roll_no
     except psycopg2.Error as e:
         st.error(f"Error saving pre-assessment: {e}")
-        if conn:
-            conn.close()
         return None   
 def section_1():
     st.header("📋 Section 1: Background Information & IQ Test")
@@ -903,6 +2266,11 @@ def section_1():
             st.session_state.iq_q_index = 0
             st.session_state.iq_score = 0
             st.session_state.iq_questions = generate_questions(3, "General", "cognitive", "General", 3)
+        if len(st.session_state.iq_questions) < 3:
+            if show_question_retry("iq_retry"):
+                del st.session_state.iq_q_index
+                st.rerun()
+            return
         if st.session_state.iq_q_index < 3:
             q = st.session_state.iq_questions[st.session_state.iq_q_index]
             st.write(f"**Q{st.session_state.iq_q_index + 1}:** {q['question_text']}")
@@ -961,11 +2329,154 @@ def section_1():
         else:
             st.error("Failed to save data.")
 def get_quiz_model():
-    genai.configure(api_key=GEMINI_API_KEY_QUIZ)
-    return genai.GenerativeModel('gemini-2.0-flash')
-def generate_questions(level, topic, section_type, domain, num_questions=1):
-    """Generate quiz questions based on difficulty level and course domain."""
-    quiz_model = get_quiz_model()
+    return get_gemini_model(GEMINI_API_KEY_QUIZ)
+def question_type_for_level(level):
+    """Question format used at each difficulty level"""
+    if level <= 3:
+        return "mcq"
+    elif level == 4:
+        return "multi_select"
+    return "fill_in_the_blank"
+def is_valid_question(q):
+    """Check that a generated question has everything the quiz forms need"""
+    if not isinstance(q, dict) or not q.get("question_text"):
+        return False
+    q_type = q.get("question_type")
+    if q_type in ["mcq", "multi_select"] and (not isinstance(q.get("options"), list) or not q.get("options")):
+        return False
+    if q_type == "fill_in_the_blank" and not q.get("correct_answer"):
+        return False
+    return True
+def is_complete_question(q, question_type):
+    """Typed check for a generated question: the expected type, and an answer the grader can match"""
+    if not is_valid_question(q) or q.get("question_type") != question_type:
+        return False
+    if question_type == "multi_select":
+        answers = q.get("correct_answers")
+        return isinstance(answers, list) and bool(answers) and all(answer in q["options"] for answer in answers)
+    answer = q.get("correct_answer")
+    if question_type == "mcq":
+        return answer in q["options"]
+    return isinstance(answer, str) and bool(answer.strip())
+def question_schema(question_type, with_topic_no=False):
+    """response_schema for a JSON array of questions of one type"""
+    properties = {"question_text": {"type": "STRING"}, "question_type": {"type": "STRING"}, "explanation": {"type": "STRING"}}
+    required = ["question_text", "question_type"]
+    if question_type in ["mcq", "multi_select"]:
+        properties["options"] = {"type": "ARRAY", "items": {"type": "STRING"}}
+        required.append("options")
+    if question_type == "multi_select":
+        properties["correct_answers"] = {"type": "ARRAY", "items": {"type": "STRING"}}
+        required.append("correct_answers")
+    else:
+        properties["correct_answer"] = {"type": "STRING"}
+        required.append("correct_answer")
+    if with_topic_no:
+        properties["topic_no"] = {"type": "INTEGER"}
+        required.append("topic_no")
+    return {"type": "ARRAY", "items": {"type": "OBJECT", "properties": properties, "required": required}}
+def show_question_retry(key):
+    """Shown when neither Gemini nor the question bank produced a question; nothing is scored meanwhile.
+    Returns True when the student asked to try again."""
+    st.error("Couldn't generate a valid question right now, and the question bank has no unseen one for this level.")
+    return st.button("🔄 Try again", key=key)
+def question_bank_language(section_type, language):
+    # Cognitive prompts are not localised, so they share one English bucket
+    return language if section_type == "domain" else "English"
+def serve_from_question_bank(roll_no, domain, section_type, level, language, num_questions, mark_served=True):
+    """Take up to num_questions random questions from the bank that roll_no has not been served yet"""
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT id, question FROM question_bank qb
+            WHERE domain = %s AND section_type = %s AND level = %s
+              AND question_type = %s AND language = %s
+              AND NOT EXISTS (
+                  SELECT 1 FROM question_bank_served s
+                  WHERE s.question_id = qb.id AND s.roll_no = %s
+              )
+            ORDER BY random() LIMIT %s
+        """, (domain, section_type, level, question_type_for_level(level),
+              question_bank_language(section_type, language), roll_no, num_questions))
+        rows = cursor.fetchall()
+        if roll_no and rows and mark_served:
+            mark_questions_served(cursor, roll_no, [row[0] for row in rows])
+        conn.commit()
+        cursor.close()
+    return [dict(row[1], bank_id=row[0]) for row in rows]
+def mark_questions_served(cursor, roll_no, question_ids):
+    cursor.execute("""
+        INSERT INTO question_bank_served (roll_no, question_id)
+        SELECT %s, unnest(%s::int[])
+        ON CONFLICT DO NOTHING
+    """, (roll_no, question_ids))
+def add_to_question_bank(cursor, domain, section_type, level, language, questions):
+    """Insert valid questions into their bucket, skipping duplicates; returns the new ids"""
+    bucket_language = question_bank_language(section_type, language)
+    question_ids = []
+    for q in questions:
+        if not is_valid_question(q):
+            continue
+        question_hash = hashlib.sha256(
+            json.dumps([domain, section_type, level, bucket_language, q["question_text"].strip().lower()]).encode('utf-8')
+        ).hexdigest()
+        cursor.execute("""
+            INSERT INTO question_bank (domain, section_type, level, question_type, language, question, question_hash)
+            VALUES (%s, %s, %s, %s, %s, %s, %s)
+            ON CONFLICT (question_hash) DO NOTHING
+            RETURNING id
+        """, (domain, section_type, level, question_type_for_level(level), bucket_language,
+              json.dumps(q), question_hash))
+        row = cursor.fetchone()
+        if row:
+            q["bank_id"] = row[0]
+            question_ids.append(row[0])
+    return question_ids
+def generate_questions(level, topic, section_type, domain, num_questions=1, roll_no=None, language=None, mark_served=True):
+    """Generate quiz questions based on difficulty level and course domain.
+    Questions are served from the pre-generated question bank when the bucket has
+    unseen ones for roll_no; only the shortfall is generated live (and banked).
+    If live generation fails, the bank is checked again for questions banked meanwhile,
+    so fewer than num_questions (possibly none) can come back.
+    Pass language explicitly when calling off the script thread."""
+    language = language or st.session_state.selected_language
+    questions = []
+    try:
+        questions = serve_from_question_bank(roll_no, domain, section_type, level, language,
+                                             num_questions, mark_served)
+    except psycopg2.Error as e:
+        st.warning(f"Question bank unavailable, generating live: {e}")
+    if len(questions) >= num_questions:
+        return questions
+    try:
+        live_questions = generate_questions_live(level, topic, section_type, domain,
+                                                 num_questions - len(questions), language)
+    except ValueError:
+        # The rejected responses are already counted in llm_parse_failures_total
+        banked = []
+        try:
+            banked = serve_from_question_bank(roll_no, domain, section_type, level, language,
+                                              num_questions - len(questions), mark_served)
+        except psycopg2.Error:
+            pass
+        increment_counter("question_generation_fallbacks_total",
+                          {"section_type": section_type, "outcome": "bank" if banked else "empty"})
+        return questions + banked
+    try:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            question_ids = add_to_question_bank(cursor, domain, section_type, level, language, live_questions)
+            if roll_no and question_ids and mark_served:
+                mark_questions_served(cursor, roll_no, question_ids)
+            conn.commit()
+            cursor.close()
+    except psycopg2.Error as e:
+        st.warning(f"Could not add generated questions to the question bank: {e}")
+    return questions + live_questions
+def generate_questions_live(level, topic, section_type, domain, num_questions, language):
+    """Ask Gemini for num_questions new questions; raises ValueError if no valid batch arrives within the retry budget"""
+    question_type = question_type_for_level(level)
+    quiz_model = get_structured_model(GEMINI_API_KEY_QUIZ, question_schema(question_type))
 
     question_type_prompt = ""
     if level <= 3:
@@ -1022,24 +2533,109 @@ def generate_questions(level, topic, section_type, domain, num_questions=1):
         The difficulty level must be {level}/5.
         {question_type_prompt}
         Return the output as a valid JSON array.
-        All text must be in {st.session_state.selected_language}.
+        All text must be in {language}.
         """
-    try:
-        response = quiz_model.generate_content(prompt)
-        # Clean the response to extract only the JSON part
-        json_text = response.text[response.text.find('['):response.text.rfind(']') + 1]
-        questions = json.loads(json_text)
-        return questions
-    except (json.JSONDecodeError, ValueError, IndexError) as e:
-        st.error(f"Error parsing generated question. Please try again. Details: {e}")
-        # Return a fallback question to avoid crashing
-        return [{
-            "question_text": "Which of the following is a primary color?",
-            "question_type": "mcq",
-            "options": ["Green", "Blue", "Orange", "Violet"],
-            "correct_answer": "Blue",
-            "explanation": "The primary colors are Red, Yellow, and Blue."
-        }]
+    questions = generate_structured(
+        quiz_model, prompt, "questions", list,
+        lambda value: sum(is_complete_question(q, question_type) for q in value) >= num_questions
+    )
+    return [q for q in questions if is_complete_question(q, question_type)][:num_questions]
+@st.cache_resource
+def get_prefetch_executor():
+    """Worker threads that generate candidate next questions ahead of time"""
+    return ThreadPoolExecutor(max_workers=PREFETCH_MAX_WORKERS, thread_name_prefix="question-prefetch")
+def record_prefetch_event(event):
+    increment_counter("question_prefetch_total", {"outcome": event})
+def start_question_prefetch(prefix, section_type):
+    """While question N is displayed, generate both possible next questions (level +1 and -1)"""
+    next_idx = st.session_state[f"{prefix}_current_q_idx"] + 1
+    prefetch = st.session_state.get(f"{prefix}_prefetch")
+    if next_idx >= 5 or (prefetch and prefetch["idx"] == next_idx):
+        return
+    level = st.session_state[f"{prefix}_level"]
+    domain = st.session_state.student_domain
+    executor = get_prefetch_executor()
+    futures = {}
+    for next_level in {min(5, level + 1), max(1, level - 1)}:
+        futures[next_level] = executor.submit(
+            generate_questions, next_level, domain, section_type, domain, 1,
+            roll_no=st.session_state.roll_no,
+            language=st.session_state.selected_language,
+            mark_served=False
+        )
+    st.session_state[f"{prefix}_prefetch"] = {"idx": next_idx, "futures": futures}
+def take_prefetched_question(prefix):
+    """Keep the prefetched question for the level the answer led to and drop the other.
+    Returns an empty list when nothing usable was prefetched."""
+    prefetch = st.session_state.pop(f"{prefix}_prefetch", None)
+    if not prefetch or prefetch["idx"] != st.session_state[f"{prefix}_current_q_idx"]:
+        record_prefetch_event("missed")
+        return []
+    questions = []
+    for level, future in prefetch["futures"].items():
+        if level != st.session_state[f"{prefix}_level"]:
+            future.cancel()
+            record_prefetch_event("wasted")
+            continue
+        try:
+            questions = [q for q in future.result(timeout=PREFETCH_WAIT_SECONDS) if is_valid_question(q)]
+        except Exception:
+            questions = []
+    if not questions:
+        record_prefetch_event("missed")
+        return []
+    record_prefetch_event("used")
+    question_ids = [q["bank_id"] for q in questions if q.get("bank_id")]
+    if question_ids:
+        try:
+            with get_db_connection() as conn:
+                cursor = conn.cursor()
+                mark_questions_served(cursor, st.session_state.roll_no, question_ids)
+                conn.commit()
+                cursor.close()
+        except psycopg2.Error:
+            pass
+    return questions
+def question_bank_buckets():
+    """Every (domain, section_type, level, language) bucket the assessments draw from"""
+    buckets = [("General", "cognitive", 3, "English")]  # Section 1 IQ test
+    for domain in AVAILABLE_COURSES:
+        for level in range(1, 6):
+            buckets.append((domain, "cognitive", level, "English"))
+            for language in QUESTION_BANK_LANGUAGES:
+                buckets.append((domain, "domain", level, language))
+    return buckets
+def fill_question_bank(low_water=None, batch_size=None):
+    """Offline batch filler: top every question bank bucket up to the low-water mark"""
+    low_water = low_water or QUESTION_BANK_LOW_WATER
+    batch_size = batch_size or QUESTION_BANK_BATCH_SIZE
+    with get_db_connection() as conn:
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT domain, section_type, level, language, COUNT(*) FROM question_bank
+            GROUP BY domain, section_type, level, language
+        """)
+        counts = {tuple(row[:4]): row[4] for row in cursor.fetchall()}
+        cursor.close()
+    for domain, section_type, level, language in question_bank_buckets():
+        have = counts.get((domain, section_type, level, language), 0)
+        failures = 0
+        while have < low_water and failures < 3:
+            try:
+                questions = generate_questions_live(level, domain, section_type, domain,
+                                                    min(batch_size, low_water - have), language)
+                with get_db_connection() as conn:
+                    cursor = conn.cursor()
+                    added = len(add_to_question_bank(cursor, domain, section_type, level, language, questions))
+                    conn.commit()
+                    cursor.close()
+            except Exception as e:
+                print(f"[question bank] {domain} / {section_type} / L{level} / {language}: {e}")
+                added = 0
+            if added == 0:
+                failures += 1
+            have += added
+        print(f"[question bank] {domain} / {section_type} / L{level} / {language}: {have} questions")
 def check_answer(user_answer, correct_answer, question_type):
     """Check if the user's answer is correct for various question types."""
     if question_type == "mcq":
@@ -1087,37 +2683,28 @@ def section_2():
                 topic=st.session_state.student_domain,
                 section_type="cognitive",
                 domain=st.session_state.student_domain,
-                num_questions=1
+                num_questions=1,
+                roll_no=st.session_state.roll_no
             )
             if new_questions:
                 st.session_state.s2_questions.extend(new_questions)
                 st.rerun()
-            else:
-                st.error("Failed to generate a question. Please refresh.")
-                return
+        show_question_retry("s2_retry")  # clicking it reruns, which generates again
+        return
 
     # Display the current question if available
     if len(st.session_state.s2_questions) > st.session_state.s2_current_q_idx:
         q = st.session_state.s2_questions[st.session_state.s2_current_q_idx]
         
         # --- START OF NEW VALIDATION LOGIC ---
-        is_valid = True
         q_type = q.get("question_type")
-        if not all(k in q for k in ["question_text"]):
-            is_valid = False
-        if q_type in ["mcq", "multi_select"] and (not isinstance(q.get("options"), list) or not q.get("options")):
-            is_valid = False
-        if q_type == "fill_in_the_blank" and not q.get("correct_answer"):
-            is_valid = False
-
-        if not is_valid:
-            st.warning("🔄 The generated question was incomplete. Automatically fetching a new one...")
-            # Remove the invalid question and rerun to generate a new one
+        if not is_valid_question(q):
+            # Generated questions are validated (and retried) before they get here, so this only
+            # catches legacy question bank rows; drop it and serve the next one from the bank
             st.session_state.s2_questions.pop(st.session_state.s2_current_q_idx)
-            time.sleep(1) 
             st.rerun()
-            return
         # --- END OF NEW VALIDATION LOGIC ---
+        start_question_prefetch("s2", "cognitive")
 
         with st.form(f"s2_form_{st.session_state.s2_current_q_idx}"):
             st.write(f"**{q['question_text']}**")
@@ -1144,6 +2731,8 @@ def section_2():
                         st.session_state.s2_level -= 1
 
                 st.session_state.s2_current_q_idx += 1
+                if st.session_state.s2_current_q_idx < 5:
+                    st.session_state.s2_questions.extend(take_prefetched_question("s2"))
 
                 if st.session_state.s2_current_q_idx >= 5:
                     st.session_state.s2_completed = True
@@ -1155,136 +2744,162 @@ def section_2():
                 st.rerun()
 def update_cognitive_scores(roll_no, cognitive_score, cognitive_iq):
     """Update cognitive score and IQ in database"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE pre_assessment 
-            SET cognitive_score = %s, cognitive_iq = %s 
-            WHERE roll_no = %s
-        """, (cognitive_score, cognitive_iq, roll_no))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        analyze_and_update_performance(roll_no)
-        return True      
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE pre_assessment 
+                SET cognitive_score = %s, cognitive_iq = %s 
+                WHERE roll_no = %s
+            """, (cognitive_score, cognitive_iq, roll_no))
+            updated = cursor.rowcount
+            mark_agent_data_dirty(cursor, roll_no)
+            conn.commit()
+            invalidate_student_data(roll_no)
+            cursor.close()
+        if updated:
+            note_performance_change(roll_no)
+        return True
     except psycopg2.Error as e:
         st.error(f"Error updating cognitive scores: {e}")
-        if conn:
-            conn.close()
         return False
+def performance_outcome(state):
+    """topics_excellented, outcome_of_course and student_progress for a performance state"""
+    student = state["student"]
+    excellented_topics = []
+    if student['cognitive_score'] >= 80:
+        excellented_topics.append("Logical Reasoning")
+        excellented_topics.append("Problem Solving")
+    if student['domain_score'] >= 80:
+        domain = student['domain']
+        if domain == "Python":
+            excellented_topics.extend(["Python Fundamentals", "Programming Logic"])
+        elif domain == "Data Science":
+            excellented_topics.extend(["Data Analysis", "Statistical Concepts"])
+        elif domain == "Machine Learning":
+            excellented_topics.extend(["ML Algorithms", "Model Training"])
+    if student['viva_score'] >= 80:
+        excellented_topics.append("Communication Skills")
+        excellented_topics.append("Technical Explanation")
+    for week_no, (week_quiz_score, strong_areas) in sorted(state["weeks"].items()):
+        if week_quiz_score >= 80:
+            if strong_areas and strong_areas != 'None identified':
+                excellented_topics.append(f"Week {week_no}: {strong_areas}")
+    avg_score = (student['cognitive_score'] + student['domain_score'] + student['viva_score']) / 3        
+    if avg_score >= 80:
+        outcome = "Excellent performance - Ready for advanced topics"
+        progress = "Outstanding learner with strong grasp of concepts"
+    elif avg_score >= 70:
+        outcome = "Good performance - Solid foundation established"  
+        progress = "Good learner with areas for improvement identified"
+    elif avg_score >= 60:
+        outcome = "Satisfactory performance - Basic concepts understood"
+        progress = "Average learner requiring additional practice"
+    else:
+        outcome = "Needs improvement - Requires additional support"
+        progress = "Struggling learner needing focused remediation"
+    # Sorted so an unchanged outcome produces the same text and its write can be skipped
+    topics_str = ", ".join(sorted(set(excellented_topics))) if excellented_topics else "No topics excellented yet"        
+    return topics_str, outcome, progress
+def load_performance_state(cursor, roll_no):
+    """Read the inputs of roll_no's overall performance, or None.
+    The pre_assessment row stays locked until the transaction ends, so concurrent score writes wait for it."""
+    cursor.execute("""
+        SELECT domain, cognitive_score, domain_score, viva_score
+        FROM pre_assessment WHERE roll_no = %s
+        FOR UPDATE
+    """, (roll_no,))
+    student = cursor.fetchone()
+    if not student:
+        return None
+    cursor.execute("""
+        SELECT week_no, week_quiz_score, strong_areas
+        FROM week_quiz WHERE roll_no = %s ORDER BY week_no
+    """, (roll_no,))
+    return {
+        "student": {key: student[key] for key in ("domain", "cognitive_score", "domain_score", "viva_score")},
+        "weeks": {week['week_no']: (week['week_quiz_score'], week['strong_areas']) for week in cursor.fetchall()}
+    }
+def note_performance_change(roll_no):
+    """Queue roll_no for the next performance flush after a committed score or week quiz change"""
+    st.session_state.setdefault("performance_pending", set()).add(roll_no)
+def flush_performance_updates(roll_no=None):
+    """Write the coalesced performance updates queued in this session (only roll_no's, if given)"""
+    pending = st.session_state.get("performance_pending")
+    if not pending:
+        return
+    for pending_roll_no in ([roll_no] if roll_no in pending else [] if roll_no else list(pending)):
+        analyze_and_update_performance(pending_roll_no)
 def analyze_and_update_performance(roll_no):
-    """Analyze student performance and update topics_excellented"""
-    conn = get_db_connection()
-    if conn is None:
-        return False   
+    """Analyze student performance and update topics_excellented.
+    The inputs are read and locked in the same transaction as the write, and the UPDATE
+    compares against the stored row, so an unchanged outcome writes nothing."""
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)       
-        cursor.execute("""
-            SELECT domain, cognitive_score, domain_score, viva_score 
-            FROM pre_assessment WHERE roll_no = %s
-        """, (roll_no,))
-        student = cursor.fetchone()        
-        if not student:
-            return False
-        cursor.execute("""
-            SELECT week_no, week_quiz_score, strong_areas, weak_areas
-            FROM week_quiz WHERE roll_no = %s ORDER BY week_no
-        """, (roll_no,))
-        weekly_data = cursor.fetchall()
-        excellented_topics = []
-        if student['cognitive_score'] >= 80:
-            excellented_topics.append("Logical Reasoning")
-            excellented_topics.append("Problem Solving")
-        if student['domain_score'] >= 80:
-            domain = student['domain']
-            if domain == "Python":
-                excellented_topics.extend(["Python Fundamentals", "Programming Logic"])
-            elif domain == "Data Science":
-                excellented_topics.extend(["Data Analysis", "Statistical Concepts"])
-            elif domain == "Machine Learning":
-                excellented_topics.extend(["ML Algorithms", "Model Training"])
-        if student['viva_score'] >= 80:
-            excellented_topics.append("Communication Skills")
-            excellented_topics.append("Technical Explanation")
-        for week in weekly_data:
-            if week['week_quiz_score'] >= 80:
-                if week['strong_areas'] and week['strong_areas'] != 'None identified':
-                    excellented_topics.append(f"Week {week['week_no']}: {week['strong_areas']}")
-        avg_score = (student['cognitive_score'] + student['domain_score'] + student['viva_score']) / 3        
-        if avg_score >= 80:
-            outcome = "Excellent performance - Ready for advanced topics"
-            progress = "Outstanding learner with strong grasp of concepts"
-        elif avg_score >= 70:
-            outcome = "Good performance - Solid foundation established"  
-            progress = "Good learner with areas for improvement identified"
-        elif avg_score >= 60:
-            outcome = "Satisfactory performance - Basic concepts understood"
-            progress = "Average learner requiring additional practice"
-        else:
-            outcome = "Needs improvement - Requires additional support"
-            progress = "Struggling learner needing focused remediation"
-        topics_str = ", ".join(set(excellented_topics)) if excellented_topics else "No topics excellented yet"        
-        cursor.execute("""
-            UPDATE overall_performance 
-            SET topics_excellented = %s, outcome_of_course = %s, student_progress = %s,
-                last_updated = CURRENT_TIMESTAMP
-            WHERE roll_no = %s
-        """, (topics_str, outcome, progress, roll_no))       
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True        
+        with get_db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)       
+            state = load_performance_state(cursor, roll_no)
+            if not state:
+                return False
+            outcome = performance_outcome(state)
+            cursor.execute("""
+                UPDATE overall_performance 
+                SET topics_excellented = %s, outcome_of_course = %s, student_progress = %s,
+                    last_updated = CURRENT_TIMESTAMP
+                WHERE roll_no = %s
+                  AND (topics_excellented, outcome_of_course, student_progress) IS DISTINCT FROM (%s, %s, %s)
+                RETURNING roll_no
+            """, outcome + (roll_no,) + outcome)
+            if cursor.fetchone():
+                mark_agent_data_dirty(cursor, roll_no)
+                conn.commit()
+                invalidate_student_data(roll_no)
+            cursor.close()
+        st.session_state.get("performance_pending", set()).discard(roll_no)
+        return True
     except psycopg2.Error as e:
         st.error(f"Error updating performance: {e}")
-        if conn:
-            conn.close()
         return False
 def update_domain_scores(roll_no, domain_score, domain_iq):
     """Update domain score and IQ in database"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE pre_assessment 
-            SET domain_score = %s, domain_iq = %s 
-            WHERE roll_no = %s
-        """, (domain_score, domain_iq, roll_no))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        analyze_and_update_performance(roll_no)
-        return True        
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE pre_assessment 
+                SET domain_score = %s, domain_iq = %s 
+                WHERE roll_no = %s
+            """, (domain_score, domain_iq, roll_no))
+            updated = cursor.rowcount
+            mark_agent_data_dirty(cursor, roll_no)
+            conn.commit()
+            invalidate_student_data(roll_no)
+            cursor.close()
+        if updated:
+            note_performance_change(roll_no)
+        return True
     except psycopg2.Error as e:
         st.error(f"Error updating domain scores: {e}")
-        if conn:
-            conn.close()
         return False
 def update_viva_score(roll_no, viva_score, viva_response):
     """Update viva score and response"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE pre_assessment 
-            SET viva_score = %s, viva_response = %s 
-            WHERE roll_no = %s
-        """, (viva_score, viva_response, roll_no))
-        conn.commit()
-        cursor.close()
-        conn.close()
-        analyze_and_update_performance(roll_no)
-        return True        
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE pre_assessment 
+                SET viva_score = %s, viva_response = %s 
+                WHERE roll_no = %s
+            """, (viva_score, viva_response, roll_no))
+            updated = cursor.rowcount
+            mark_agent_data_dirty(cursor, roll_no)
+            conn.commit()
+            invalidate_student_data(roll_no)
+            cursor.close()
+        if updated:
+            note_performance_change(roll_no)
+        return True
     except psycopg2.Error as e:
         st.error(f"Error updating viva score: {e}")
-        if conn:
-            conn.close()
         return False
 def calculate_iq_score(correct_answers, total_questions, difficulty_level):
     """Calculate IQ score"""
@@ -1330,37 +2945,28 @@ def section_3():
                 topic=st.session_state.student_domain,
                 section_type="domain",
                 domain=st.session_state.student_domain,
-                num_questions=1
+                num_questions=1,
+                roll_no=st.session_state.roll_no
             )
             if new_questions:
                 st.session_state.s3_questions.extend(new_questions)
                 st.rerun()
-            else:
-                st.error("Failed to generate a question. Please refresh.")
-                return
+        show_question_retry("s3_retry")  # clicking it reruns, which generates again
+        return
 
     # Display the current question
     if len(st.session_state.s3_questions) > st.session_state.s3_current_q_idx:
         q = st.session_state.s3_questions[st.session_state.s3_current_q_idx]
 
         # --- START OF NEW VALIDATION LOGIC ---
-        is_valid = True
         q_type = q.get("question_type")
-        if not all(k in q for k in ["question_text"]):
-            is_valid = False
-        if q_type in ["mcq", "multi_select"] and (not isinstance(q.get("options"), list) or not q.get("options")):
-            is_valid = False
-        if q_type == "fill_in_the_blank" and not q.get("correct_answer"):
-            is_valid = False
-
-        if not is_valid:
-            st.warning("🔄 The generated question was incomplete. Automatically fetching a new one...")
-            # Remove the invalid question and rerun to generate a new one
+        if not is_valid_question(q):
+            # Generated questions are validated (and retried) before they get here, so this only
+            # catches legacy question bank rows; drop it and serve the next one from the bank
             st.session_state.s3_questions.pop(st.session_state.s3_current_q_idx)
-            time.sleep(1)
             st.rerun()
-            return
         # --- END OF NEW VALIDATION LOGIC ---
+        start_question_prefetch("s3", "domain")
 
         with st.form(f"s3_form_{st.session_state.s3_current_q_idx}"):
             st.write(f"**{q['question_text']}**")
@@ -1387,6 +2993,8 @@ def section_3():
                         st.session_state.s3_level -= 1
 
                 st.session_state.s3_current_q_idx += 1
+                if st.session_state.s3_current_q_idx < 5:
+                    st.session_state.s3_questions.extend(take_prefetched_question("s3"))
 
                 if st.session_state.s3_current_q_idx >= 5:
                     st.session_state.s3_completed = True
@@ -1409,7 +3017,7 @@ def section_4():
             st.session_state.current_section = 5
             st.rerun()
         return
-    student_data = get_student_data(st.session_state.roll_no)
+    student_data = get_student_data(st.session_state.roll_no, include_content=False)
     if not student_data:
         st.error("Failed to retrieve student data")
         return
@@ -1437,9 +3045,22 @@ def section_4():
                 st.rerun()
             else:
                 st.error("Please provide an answer")
+VIVA_QUESTION_SCHEMA = {
+    "type": "OBJECT",
+    "properties": {
+        "question": {"type": "STRING"},
+        "expected_points": {"type": "ARRAY", "items": {"type": "STRING"}},
+        "evaluation_criteria": {"type": "STRING"}
+    },
+    "required": ["question", "expected_points", "evaluation_criteria"]
+}
+def is_valid_viva_question(viva):
+    return (isinstance(viva.get("question"), str) and bool(viva["question"].strip())
+            and isinstance(viva.get("expected_points"), list) and all(isinstance(p, str) for p in viva["expected_points"])
+            and isinstance(viva.get("evaluation_criteria"), str))
 def generate_viva_question(domain, cognitive_score, domain_score):
     """Generate a viva question based on domain and scores"""
-    viva_model = get_viva_model()   
+    viva_model = get_structured_model(GEMINI_API_KEY_VIVA, VIVA_QUESTION_SCHEMA)
     difficulty = "basic" if (cognitive_score + domain_score) / 2 < 60 else "intermediate" if (cognitive_score + domain_score) / 2 < 80 else "advanced"   
     prompt = f"""Generate 1 viva voce question for {domain} at {difficulty} level.  
     Format as JSON:
@@ -1450,11 +3071,7 @@ def generate_viva_question(domain, cognitive_score, domain_score):
     }}   
     Make it open-ended and suitable for oral examination focusing on {domain}."""   
     try:
-        response = viva_model.generate_content(prompt)
-        json_start = response.text.find('{')
-        json_end = response.text.rfind('}') + 1
-        json_data = response.text[json_start:json_end]
-        return json.loads(json_data)
+        return generate_structured(viva_model, prompt, "viva_question", dict, is_valid_viva_question)
     except Exception as e:
         st.error(f"Error generating viva question: {e}")
         return {
@@ -1462,39 +3079,51 @@ def generate_viva_question(domain, cognitive_score, domain_score):
             "expected_points": ["Fundamental concepts", "Practical applications", "Current trends"],
             "evaluation_criteria": "Clarity of explanation, depth of knowledge, practical understanding"
         }
-def get_student_data(roll_no):
-    """Get complete student data"""
-    conn = get_db_connection()
-    if conn is None:
-        return None
+def get_student_data(roll_no, include_content=True):
+    """Get complete student data: profile, performance, week quizzes and course contents in one query.
+    Reads are cached per session for STUDENT_DATA_TTL_SECONDS and dropped by the write helpers;
+    include_content=False leaves the course_content text of each week out."""
+    flush_performance_updates(roll_no)
+    cache = st.session_state.setdefault("student_data_cache", {})
+    cache_key = (roll_no, include_content)
+    cached = cache.get(cache_key)
+    if cached and time.monotonic() - cached[0] < STUDENT_DATA_TTL_SECONDS:
+        return cached[1]
     try:
-        cursor = conn.cursor(cursor_factory=RealDictCursor)        
-        query = """
-        SELECT pa.*, op.topics_excellented, op.outcome_of_course, op.student_progress
-        FROM pre_assessment pa
-        LEFT JOIN overall_performance op ON pa.roll_no = op.roll_no
-        WHERE pa.roll_no = %s
-        """        
-        cursor.execute(query, (roll_no,))
-        student_data = cursor.fetchone()        
-        if student_data:
-            cursor.execute("SELECT * FROM week_quiz WHERE roll_no = %s ORDER BY week_no", (roll_no,))
-            week_data = cursor.fetchall()           
-            cursor.execute("SELECT * FROM course_content WHERE roll_no = %s ORDER BY week_no", (roll_no,))
-            course_data = cursor.fetchall()            
-            result = dict(student_data)
-            result['week_quizzes'] = [dict(row) for row in week_data]
-            result['course_contents'] = [dict(row) for row in course_data]
-        else:
-            result = None        
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor(cursor_factory=RealDictCursor)        
+            query = """
+            SELECT pa.*, op.topics_excellented, op.outcome_of_course, op.student_progress,
+                COALESCE((
+                    SELECT json_agg(row_to_json(wq) ORDER BY wq.week_no)
+                    FROM week_quiz wq WHERE wq.roll_no = pa.roll_no
+                ), '[]') AS week_quizzes,
+                COALESCE((
+                    SELECT json_agg(json_build_object(
+                        'id', cc.id, 'roll_no', cc.roll_no, 'week_no', cc.week_no, 'created_at', cc.created_at,
+                        'course_content', CASE WHEN %s THEN cc.course_content END
+                    ) ORDER BY cc.week_no)
+                    FROM course_content cc WHERE cc.roll_no = pa.roll_no
+                ), '[]') AS course_contents
+            FROM pre_assessment pa
+            LEFT JOIN overall_performance op ON pa.roll_no = op.roll_no
+            WHERE pa.roll_no = %s
+            """        
+            cursor.execute(query, (include_content, roll_no))
+            student_data = cursor.fetchone()        
+            result = dict(student_data) if student_data else None
+            cursor.close()
+        cache[cache_key] = (time.monotonic(), result)
         return result
     except psycopg2.Error as e:
         st.error(f"Error retrieving student data: {e}")
-        if conn:
-            conn.close()
         return None
+def invalidate_student_data(roll_no):
+    """Drop this session's cached get_student_data() results for roll_no"""
+    cache = st.session_state.get("student_data_cache")
+    if cache:
+        for cache_key in [k for k in cache if k[0] == roll_no]:
+            del cache[cache_key]
 def section_5():
     st.header("⚙️ Section 5: Course Configuration")   
     if not st.session_state.roll_no:
@@ -1523,24 +3152,21 @@ def section_5():
                 st.error("Failed to configure course")
 def update_course_config(roll_no, hours_per_day, weeks):
     """Update course configuration"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE pre_assessment 
-            SET hours_per_day = %s, weeks = %s, course_configured = TRUE
-            WHERE roll_no = %s
-        """, (hours_per_day, weeks, roll_no))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE pre_assessment 
+                SET hours_per_day = %s, weeks = %s, course_configured = TRUE
+                WHERE roll_no = %s
+            """, (hours_per_day, weeks, roll_no))
+            mark_agent_data_dirty(cursor, roll_no)
+            conn.commit()
+            invalidate_student_data(roll_no)
+            cursor.close()
         return True
     except psycopg2.Error as e:
         st.error(f"Error updating course config: {e}")
-        if conn:
-            conn.close()
         return False
 def section_6():
     st.header("📖 Section 6: Course Learning")
@@ -1569,27 +3195,42 @@ def section_6():
                         if q['week_no'] == current_week - 1:
                             previous_analysis = q.get('analysis', '')
                             break
-                content = generate_course_content(
-                    student_data.get("domain"),
-                    current_week,
-                    student_data.get("hours_per_day", 3),
-                    previous_analysis
-                )
+                preview = st.empty()
+                with preview.container():
+                    content = generate_course_content(
+                        student_data.get("domain"),
+                        current_week,
+                        student_data.get("hours_per_day", 3),
+                        previous_analysis,
+                        stream=True
+                    )
+                preview.empty()
                 save_course_content(st.session_state.roll_no, current_week, content)
         topic_blocks = re.findall(r"(Topic\s*\d+:\s*.*?)(?=Topic\s*\d+:|$)", content, re.DOTALL)
         topics = [block.strip() for block in topic_blocks]
+        try:
+            with st.spinner("Preparing mini quizzes..."):
+                st.session_state[f"week_{current_week}_mini_quizzes"] = load_week_mini_quizzes(
+                    st.session_state.roll_no,
+                    current_week,
+                    {idx: topic_title(topic_content, idx) for idx, topic_content in enumerate(topics, start=1)},
+                    student_data["domain"]
+                )
+        except psycopg2.Error as e:
+            st.error(f"Error loading mini quizzes: {e}")
+            st.session_state[f"week_{current_week}_mini_quizzes"] = {}
         st.session_state[f"week_{current_week}_topics"] = topics
     else:
         topics = st.session_state[f"week_{current_week}_topics"]
+    week_mini_quizzes = st.session_state.get(f"week_{current_week}_mini_quizzes", {})
     st.markdown("## 📚 Topics & Mini Quizzes")
     for idx, topic_content in enumerate(topics, start=1):
-        topic_name_match = re.match(r"Topic\s*\d+:\s*(.*)", topic_content.split('\n')[0])
-        topic_name = topic_name_match.group(1).strip() if topic_name_match else f"Topic {idx}"
+        topic_name = topic_title(topic_content, idx)
         st.markdown(f"### 📝 Topic {idx}: {topic_name}")
         st.markdown(topic_content)
         quiz_key = f"mini_quiz_{current_week}_{idx}"
         if f"{quiz_key}_answered" not in st.session_state:
-            mini_quiz = generate_mini_quiz(topic_name, student_data["domain"])
+            mini_quiz = week_mini_quizzes.get(idx)
             if mini_quiz:
                 st.write(mini_quiz["question_text"])
                 answer = st.radio("Choose an answer:", mini_quiz["options"], key=f"{quiz_key}_options")
@@ -1720,61 +3361,55 @@ def section_6():
                 st.rerun()
 def update_current_week(roll_no, week_no):
     """Update current week number"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            UPDATE pre_assessment 
-            SET current_week_no = %s 
-            WHERE roll_no = %s
-        """, (week_no, roll_no))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                UPDATE pre_assessment 
+                SET current_week_no = %s 
+                WHERE roll_no = %s
+            """, (week_no, roll_no))
+            mark_agent_data_dirty(cursor, roll_no)
+            conn.commit()
+            invalidate_student_data(roll_no)
+            cursor.close()
         return True
     except psycopg2.Error as e:
         st.error(f"Error updating current week: {e}")
-        if conn:
-            conn.close()
         return False
 def save_week_quiz(roll_no, week_no, quiz_data):
     """Save week quiz results and update overall performance"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
     try:
-        cursor = conn.cursor()       
-        cursor.execute("""
-            INSERT INTO week_quiz (roll_no, week_no, week_quiz_score, week_quiz_iq, strong_areas, weak_areas, analysis)
-            VALUES (%s, %s, %s, %s, %s, %s, %s)
-            ON CONFLICT (roll_no, week_no) 
-            DO UPDATE SET 
-                week_quiz_score = EXCLUDED.week_quiz_score,
-                week_quiz_iq = EXCLUDED.week_quiz_iq,
-                strong_areas = EXCLUDED.strong_areas,
-                weak_areas = EXCLUDED.weak_areas,
-                analysis = EXCLUDED.analysis,
-                date = CURRENT_TIMESTAMP
-        """, (
-            roll_no, week_no, quiz_data.get('score', 0), quiz_data.get('iq', 0),
-            quiz_data.get('strong_areas', ''), quiz_data.get('weak_areas', ''), 
-            quiz_data.get('analysis', '')
-        ))       
-        conn.commit()
-        cursor.close()
-        conn.close()
-        analyze_and_update_performance(roll_no)
-        return True       
+        with get_db_connection() as conn:
+            cursor = conn.cursor()       
+            cursor.execute("""
+                INSERT INTO week_quiz (roll_no, week_no, week_quiz_score, week_quiz_iq, strong_areas, weak_areas, analysis)
+                VALUES (%s, %s, %s, %s, %s, %s, %s)
+                ON CONFLICT (roll_no, week_no) 
+                DO UPDATE SET 
+                    week_quiz_score = EXCLUDED.week_quiz_score,
+                    week_quiz_iq = EXCLUDED.week_quiz_iq,
+                    strong_areas = EXCLUDED.strong_areas,
+                    weak_areas = EXCLUDED.weak_areas,
+                    analysis = EXCLUDED.analysis,
+                    date = CURRENT_TIMESTAMP
+            """, (
+                roll_no, week_no, quiz_data.get('score', 0), quiz_data.get('iq', 0),
+                quiz_data.get('strong_areas', ''), quiz_data.get('weak_areas', ''), 
+                quiz_data.get('analysis', '')
+            ))       
+            mark_agent_data_dirty(cursor, roll_no)
+            conn.commit()
+            invalidate_student_data(roll_no)
+            cursor.close()
+        note_performance_change(roll_no)
+        return True
     except psycopg2.Error as e:
         st.error(f"Error saving week quiz: {e}")
-        if conn:
-            conn.close()
         return False
 def generate_weekly_quiz(domain, week_number, previous_score=None):
     """Generate weekly quiz based on domain and performance"""
-    quiz_model = get_quiz_model()    
+    quiz_model = get_structured_model(GEMINI_API_KEY_QUIZ, question_schema("mcq"))
     difficulty_adj = ""
     if previous_score is not None:
         if previous_score < 60:
@@ -1787,15 +3422,13 @@ def generate_weekly_quiz(domain, week_number, previous_score=None):
     Format as JSON array with question_text, question_type (mcq), options, correct_answer, explanation fields.
     Make questions practical and applicable to {domain}."""   
     try:
-        response = quiz_model.generate_content(prompt)
-        json_start = response.text.find('[')
-        json_end = response.text.rfind(']') + 1
-        json_data = response.text[json_start:json_end]
-        return json.loads(json_data)
+        questions = generate_structured(quiz_model, prompt, "weekly_quiz", list,
+                                        lambda value: any(is_complete_question(q, "mcq") for q in value))
+        return [q for q in questions if is_complete_question(q, "mcq")]
     except Exception as e:
         st.error(f"Error generating weekly quiz: {e}")
         return []
-def generate_course_content(domain, week_no, hours_per_day, previous_performance=None):
+def generate_course_content(domain, week_no, hours_per_day, previous_performance=None, stream=False):
     model = get_quiz_model()  
     prompt = f"""
 Generate course content for **Week {week_no}** of a **{domain}** course.
@@ -1829,8 +3462,9 @@ Topic 3: Loops
     if previous_performance:
         prompt += f"\n\n📈 Adjust content difficulty or focus based on the following performance feedback:\n{previous_performance}"
     try:
-        response = model.generate_content(prompt)
-        return response.text
+        if stream:
+            return st.write_stream(stream_llm_text(model, prompt, "course_content"))
+        return generate_llm_text(model, prompt, "course_content")
     except Exception as e:
         st.error(f"Error generating course content: {e}")
         return f"Week {week_no} content for {domain} could not be generated."
@@ -1843,37 +3477,31 @@ def extract_topics_from_content(course_content):
     return [t for t in topics if len(t.split()) >= 2] 
 def save_course_content(roll_no, week_no, content):
     """Save course content to database"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            INSERT INTO course_content (roll_no, week_no, course_content)
-            VALUES (%s, %s, %s)
-            ON CONFLICT (roll_no, week_no) 
-            DO UPDATE SET course_content = EXCLUDED.course_content
-        """, (roll_no, week_no, content))
-        conn.commit()
-        cursor.close()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("""
+                INSERT INTO course_content (roll_no, week_no, course_content)
+                VALUES (%s, %s, %s)
+                ON CONFLICT (roll_no, week_no) 
+                DO UPDATE SET course_content = EXCLUDED.course_content
+            """, (roll_no, week_no, content))
+            conn.commit()
+            invalidate_student_data(roll_no)
+            cursor.close()
         return True
     except psycopg2.Error as e:
         st.error(f"Error saving course content: {e}")
-        if conn:
-            conn.close()
         return False
 def section_7():
     st.header("📊 Section 7: Performance Analysis")  
     if not st.session_state.roll_no:
         st.error("Please complete previous sections first")
         return   
-    student_data = get_student_data(st.session_state.roll_no)
+    student_data = get_student_data(st.session_state.roll_no, include_content=False)
     if not student_data:
         st.error("Failed to retrieve student data")
         return
-    analyze_and_update_performance(st.session_state.roll_no)
-    student_data = get_student_data(st.session_state.roll_no)
     st.markdown("### 🎯 Your Learning Journey Dashboard")
     col1, col2, col3, col4 = st.columns(4)
     with col1:
@@ -1977,68 +3605,44 @@ def section_7():
         st.success("Report generated! (Feature would download PDF in full implementation)")
     st.markdown("### 🔄 Preparing data for final course generation...")
     with st.spinner("Running background agents..."):
-        run_agent_pre_assessment(st.session_state.roll_no)
-        run_agent_mini_quiz(st.session_state.roll_no)
-        run_agent_weekly_quiz(st.session_state.roll_no)
-        run_agent_overall_performance(st.session_state.roll_no)
-        run_agent_course_fetch(st.session_state.roll_no)
-        run_agent_trend_fetch(st.session_state.roll_no)
+        try:
+            report = run_background_agents(st.session_state.roll_no)
+        except psycopg2.Error as e:
+            st.error(f"Error saving agent results: {e}")
+            return
+    if report["failures"]:
+        st.warning("⚠️ Some agents did not finish and kept their previous results: " +
+                   ", ".join(f"{name} ({reason})" for name, reason in report["failures"].items()))
+    if len(report["skipped"]) == len(BACKGROUND_AGENTS):
+        st.caption("⏱️ No new results since the last analysis; agent outputs are up to date.")
+    else:
+        st.caption(f"⏱️ Agents ran concurrently in {report['wall_seconds']:.1f}s "
+                   f"(about {report['sequential_seconds']:.1f}s if run one after another); "
+                   f"{len(report['skipped'])} unchanged agent(s) skipped")
     st.success("Agent processing complete! You can now go to Section 8 to generate your course.")
-def create_login_table():
-    """Create login table"""
-    conn = get_db_connection()
-    if conn is None:
-        return False
-    try:
-        cursor = conn.cursor()
-        create_login_query = """
-        CREATE TABLE IF NOT EXISTS user_login (
-            id SERIAL PRIMARY KEY,
-            email VARCHAR(255) UNIQUE NOT NULL,
-            password VARCHAR(255) NOT NULL,
-            total_logins INTEGER DEFAULT 0,
-            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            last_login TIMESTAMP
-        );"""        
-        cursor.execute(create_login_query)
-        conn.commit()
-        cursor.close()
-        conn.close()
-        return True
-    except psycopg2.Error as e:
-        st.error(f"Error creating login table: {e}")
-        if conn:
-            conn.close()
-        return False
 def login_user(email, password):
     """Login user"""
-    conn = get_db_connection()
-    if conn is None:
-        return False, "Database connection error"    
     try:
-        cursor = conn.cursor()
-        cursor.execute("""
-            SELECT email, password FROM user_login 
-            WHERE email = %s AND password = %s
-        """, (email, password))       
-        user = cursor.fetchone()
-        if user:
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
             cursor.execute("""
-                UPDATE user_login 
-                SET total_logins = total_logins + 1, last_login = CURRENT_TIMESTAMP 
-                WHERE email = %s
-            """, (email,))
-            conn.commit()
-            cursor.close()
-            conn.close()
-            return True, "Login successful"
-        else:
-            cursor.close()
-            conn.close()
-            return False, "Invalid email or password"
+                SELECT email, password FROM user_login 
+                WHERE email = %s AND password = %s
+            """, (email, password))       
+            user = cursor.fetchone()
+            if user:
+                cursor.execute("""
+                    UPDATE user_login 
+                    SET total_logins = total_logins + 1, last_login = CURRENT_TIMESTAMP 
+                    WHERE email = %s
+                """, (email,))
+                conn.commit()
+                cursor.close()
+                return True, "Login successful"
+            else:
+                cursor.close()
+                return False, "Invalid email or password"
     except psycopg2.Error as e:
-        if conn:
-            conn.close()
         return False, f"Login error: {e}"
 def generate_video_script_from_content(file_summary, file_name):
     prompt = f"""
@@ -2070,8 +3674,7 @@ def generate_video_script_from_content(file_summary, file_name):
 """
     model = get_super_agent_model()
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        return generate_llm_text(model, prompt, "video_script").strip()
     except Exception as e:
         return f"Error generating video script: {e}"
 def login_page():
@@ -2121,27 +3724,21 @@ def register_user(email, password):
     """Register new user"""
     if not validate_email(email):
         return False, "Invalid email format"    
-    conn = get_db_connection()
-    if conn is None:
-        return False, "Database connection error"    
     try:
-        cursor = conn.cursor()
-        cursor.execute("SELECT email FROM user_login WHERE email = %s", (email,))
-        if cursor.fetchone():
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT email FROM user_login WHERE email = %s", (email,))
+            if cursor.fetchone():
+                cursor.close()
+                return False, "Email already registered"        
+            cursor.execute("""
+                INSERT INTO user_login (email, password) 
+                VALUES (%s, %s)
+            """, (email, password))        
+            conn.commit()
             cursor.close()
-            conn.close()
-            return False, "Email already registered"        
-        cursor.execute("""
-            INSERT INTO user_login (email, password) 
-            VALUES (%s, %s)
-        """, (email, password))        
-        conn.commit()
-        cursor.close()
-        conn.close()
         return True, "Registration successful"
     except psycopg2.Error as e:
-        if conn:
-            conn.close()
         return False, f"Registration error: {e}"
 def validate_email(email):
     """Validate email format"""
@@ -2161,16 +3758,16 @@ def section_8():
         st.session_state.final_course_content = ""
     if 'final_video_script' not in st.session_state:
         st.session_state.final_video_script = ""
-    if 'final_video_id' not in st.session_state:
-        st.session_state.final_video_id = None
+    if 'final_video_job_id' not in st.session_state:
+        st.session_state.final_video_job_id = None
 
     if st.button("🧠 Generate Final Course") and not st.session_state.final_course_generated:
         with st.spinner("Generating final personalized course using Gemini..."):
-            final_course = run_super_agent_generate_course(roll_no)
+            final_course = run_super_agent_generate_course(roll_no, stream=True)
 
         if final_course:
             st.session_state.final_course_content = final_course
-            student = get_student_data(roll_no)
+            student = get_student_data(roll_no, include_content=False) or {}
             present_domain = student.get("present_domain", "their industry")
             interested_field = student.get("interested_field", "technology")
             student_name = student.get("name", "the learner")
@@ -2180,11 +3777,12 @@ def section_8():
                     course_text=final_course,
                     present_domain=present_domain,
                     interested_field=interested_field,
-                    student_name=student_name
+                    student_name=student_name,
+                    stream=True
                 )
             st.session_state.final_video_script = video_script
             st.session_state.final_course_generated = True
-            st.session_state.final_video_id = None # Reset video ID
+            st.session_state.final_video_job_id = None # Reset video ID
             st.rerun()
         else:
             st.error("❌ Failed to generate course. Please check agent data.")
@@ -2223,60 +3821,27 @@ def section_8():
                 st.error("Could not extract a valid script to generate video.")
             else:
                 with st.spinner("Sending script to video generator..."):
-                    create_response = create_tavus_video(TAVUS_API_KEY, script_text)
-
-                    if create_response and create_response.get("video_id"):
-                        video_id = create_response["video_id"]
-                        st.session_state.final_video_id = video_id
-                        st.success(f"✅ Video generation started! Video ID: `{video_id}`")
-                        st.write("⏳ Waiting for video to be ready... This can take a few minutes.")
-
-                        video_url = None
-                        max_attempts = 60
-                        
-                        for attempt in range(max_attempts):
-                            status_response = check_tavus_video_status(TAVUS_API_KEY, video_id)
-                            
-                            if status_response and 'status' in status_response:
-                                status = status_response.get("status")
-                                st.info(f"Video status: '{status}' (Attempt {attempt + 1}/{max_attempts})")
-
-                                if status == "completed" or status == "ready":
-                                    video_url = status_response.get("download_url")
-                                    if video_url:
-                                        st.success("🎉 Your video is ready!")
-                                        st.video(video_url)
-                                        break
-                                elif status == "failed":
-                                    error_message = status_response.get('error', 'Unknown error')
-                                    st.error(f"🚫 Video creation failed: {error_message}")
-                                    break
-                            else:
-                                st.warning("Could not retrieve video status. Will retry...")
-
-                            time.sleep(5)
-
-                        if not video_url:
-                            st.warning("⏰ Video is still processing or may have failed.")
-
-        # Display video if it was generated in a previous run
-        if st.session_state.final_video_id and not st.video:
-             with st.spinner("Checking status of existing video..."):
-                status_response = check_tavus_video_status(TAVUS_API_KEY, st.session_state.final_video_id)
-                if status_response and (status_response.get("status") == "completed" or status_response.get("status") == "ready"):
-                    video_url = status_response.get("download_url")
-                    if video_url:
-                        st.success("🎉 Your previously generated video is ready!")
-                        st.video(video_url)
+                    job_id = enqueue_video_job(roll_no, "final_course", script_text)
+                if job_id:
+                    st.session_state.final_video_job_id = job_id
+                    st.success("✅ Video generation started!")
+
+        # Show the video job started in this or an earlier run
+        if st.session_state.final_video_job_id:
+            render_video_job(st.session_state.final_video_job_id)
 def main():
     if 'logged_in' not in st.session_state:
         st.session_state.logged_in = False
     if 'db_initialized' not in st.session_state:
-        if create_tables() and create_login_table():
+        if create_tables():
             st.session_state.db_initialized = True
         else:
             st.error("Failed to initialize database.")
             return
+    # Resume polling for video jobs left queued by earlier sessions or restarts
+    start_video_job_worker()
+    start_metrics_server()
+    start_metrics_persister()
     if not st.session_state.logged_in:
         login_page()
         return
@@ -2323,21 +3888,34 @@ def main():
         if st.button("Navigate"):
             st.session_state.current_section = sections.index(selected_section) + 1
             st.rerun()
-    if st.session_state.current_section == 1:
-        section_1()
-    elif st.session_state.current_section == 2:
-        section_2()
-    elif st.session_state.current_section == 3:
-        section_3()
-    elif st.session_state.current_section == 4:
-        section_4()
-    elif st.session_state.current_section == 5:
-        section_5()
-    elif st.session_state.current_section == 6:
-        section_6()
-    elif st.session_state.current_section == 7:
-        section_7()
-    elif st.session_state.current_section == 8:
-        section_8()  
+    try:
+        if st.session_state.current_section == 1:
+            section_1()
+        elif st.session_state.current_section == 2:
+            section_2()
+        elif st.session_state.current_section == 3:
+            section_3()
+        elif st.session_state.current_section == 4:
+            section_4()
+        elif st.session_state.current_section == 5:
+            section_5()
+        elif st.session_state.current_section == 6:
+            section_6()
+        elif st.session_state.current_section == 7:
+            section_7()
+        elif st.session_state.current_section == 8:
+            section_8()
+    finally:
+        # Write the performance updates coalesced during this run, including runs cut short by st.rerun()
+        flush_performance_updates()
 if __name__ == "__main__":
-    main()
+    if "--fill-question-bank" in sys.argv:
+        # python app.py --fill-question-bank  (run offline, e.g. from cron)
+        if create_tables():
+            fill_question_bank()
+    elif "--migrate-file-blobs" in sys.argv:
+        # python app.py --migrate-file-blobs  (one-off move of base64 uploads into file_blobs)
+        if create_tables():
+            print(f"[file blobs] migrated {migrate_file_data_to_blobs()} uploads")
+    else:
+        main()
@@ -0,0 +1,100 @@
+"""End-to-end benchmark: time students walking sections 1-8 against fake Gemini and Tavus.
+
+    DB_NAME=ai_bench python -m benchmarks.bench_sections --runs 5 --llm-latency 0.5
+
+Needs a local Postgres (DB_HOST/DB_NAME/DB_USER/DB_PASSWORD/DB_PORT); use a scratch
+database, since the LLM cache and question bank make later runs faster than the first.
+Reports p50/p95 latency per page for single reruns and for the whole page, plus DB
+round-trips and LLM calls per rerun.
+"""
+import argparse
+import json
+import os
+import socket
+from collections import defaultdict
+
+from benchmarks.fakes import install_fake_gemini, start_fake_tavus
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def prepare_environment(llm_latency, seconds_per_1k_chars, tavus_render_seconds):
+    """Point app.py at the fake backends; must run before the first AppTest"""
+    install_fake_gemini(llm_latency, seconds_per_1k_chars)
+    os.environ["TAVUS_API_URL"] = start_fake_tavus(tavus_render_seconds)
+    os.environ.setdefault("METRICS_PORT", str(free_port()))
+
+
+def summarize(runs):
+    """Per-page statistics over a list of per-student rerun records"""
+    reruns, page_totals = defaultdict(list), defaultdict(list)
+    for records in runs:
+        totals = defaultdict(float)
+        for record in records:
+            reruns[record["page"]].append(record)
+            totals[record["page"]] += record["seconds"]
+        for page, seconds in totals.items():
+            page_totals[page].append(seconds)
+    summary = {}
+    for page in sorted(reruns, key=lambda p: (p != "login", p)):
+        records = reruns[page]
+        summary[page] = {
+            "reruns": len(records) / len(runs),
+            "rerun_p50": percentile([r["seconds"] for r in records], 50),
+            "rerun_p95": percentile([r["seconds"] for r in records], 95),
+            "page_p50": percentile(page_totals[page], 50),
+            "page_p95": percentile(page_totals[page], 95),
+            "db_calls_per_rerun": sum(r["db_calls"] for r in records) / len(records),
+            "llm_calls_per_rerun": sum(r["llm_calls"] for r in records) / len(records),
+        }
+    return summary
+
+
+def print_summary(summary, student_seconds):
+    print(f"{'page':<11}{'reruns':>8}{'rerun p50':>11}{'rerun p95':>11}{'page p50':>10}{'page p95':>10}"
+          f"{'DB/rerun':>10}{'LLM/rerun':>11}")
+    for page, stats in summary.items():
+        print(f"{page:<11}{stats['reruns']:>8.1f}{stats['rerun_p50']:>10.2f}s{stats['rerun_p95']:>10.2f}s"
+              f"{stats['page_p50']:>9.2f}s{stats['page_p95']:>9.2f}s"
+              f"{stats['db_calls_per_rerun']:>10.1f}{stats['llm_calls_per_rerun']:>11.2f}")
+    print(f"whole flow p50 {percentile(student_seconds, 50):.2f}s  p95 {percentile(student_seconds, 95):.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--runs", type=int, default=3, help="students to walk through, one after another")
+    parser.add_argument("--weeks", type=int, default=2, help="course length chosen in section 5")
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="fake Gemini seconds before the first token")
+    parser.add_argument("--llm-seconds-per-1k", type=float, default=0.2, help="fake Gemini seconds per 1,000 chars")
+    parser.add_argument("--tavus-render-seconds", type=float, default=5.0)
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+    prepare_environment(args.llm_latency, args.llm_seconds_per_1k, args.tavus_render_seconds)
+    from benchmarks.driver import drive_student
+    runs = []
+    for run_no in range(1, args.runs + 1):
+        records = drive_student(weeks=args.weeks)
+        runs.append(records)
+        print(f"run {run_no}: {len(records)} reruns, {sum(r['seconds'] for r in records):.1f}s")
+    summary = summarize(runs)
+    print_summary(summary, [sum(r["seconds"] for r in records) for records in runs])
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "pages": summary}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
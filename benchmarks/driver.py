@@ -0,0 +1,167 @@
+"""Walk one simulated student from login_page through section_8 with Streamlit's AppTest.
+
+Every rerun is timed and labelled with the page it started on. DB round-trips and LLM
+calls per rerun are read from the app's own Prometheus endpoint (METRICS_PORT).
+"""
+import os
+import time
+import urllib.request
+import uuid
+
+import psycopg2
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+# Buttons the driver clicks, most specific first; "Submit Answer" covers sections 1, 2, 3 and 6
+ACTIONS = [
+    "Login", "Next → IQ Test", "Submit Mini Quiz", "Submit Answer", "Submit & Proceed",
+    "Proceed to Section 3", "Proceed to Section 4", "Submit Viva Answer", "Proceed to Section 5",
+    "Configure Course", "Proceed to Section 6", "Proceed to Next Week", "Continue to Next Week",
+    "View Final Analysis", "🧠 Generate Final Course", "🎬 Generate Video from Script",
+]
+# Statements issued by the app's background video poller, not by the student's rerun
+BACKGROUND_STATEMENTS = ('statement="UPDATE video_jobs"',)
+MAX_STEPS = 400
+
+
+def metrics_url():
+    return f"http://127.0.0.1:{os.environ['METRICS_PORT']}/metrics"
+
+
+def scrape_totals():
+    """Cumulative (DB statements, LLM requests) counted by the app process"""
+    try:
+        text = urllib.request.urlopen(metrics_url(), timeout=5).read().decode("utf-8")
+    except OSError:
+        return 0, 0  # the endpoint starts with the first rerun of main()
+    db_calls = llm_calls = 0
+    for line in text.splitlines():
+        if line.startswith("db_statement_seconds_count") and not any(s in line for s in BACKGROUND_STATEMENTS):
+            db_calls += float(line.rsplit(" ", 1)[1])
+        elif line.startswith("llm_request_seconds_count"):
+            llm_calls += float(line.rsplit(" ", 1)[1])
+    return db_calls, llm_calls
+
+
+def seed_student_login():
+    """Create a user_login row directly, since the driver measures the learning flow rather than registration"""
+    email, password = f"bench-{uuid.uuid4().hex[:12]}@example.com", "benchmark-password"
+    conn = psycopg2.connect(
+        host=os.environ.get("DB_HOST", "localhost"), dbname=os.environ.get("DB_NAME", "AI_2"),
+        user=os.environ.get("DB_USER", "postgres"), password=os.environ.get("DB_PASSWORD", "123456"),
+        port=os.environ.get("DB_PORT", "5432"),
+    )
+    try:
+        with conn, conn.cursor() as cursor:
+            cursor.execute("INSERT INTO user_login (email, password) VALUES (%s, %s)", (email, password))
+    finally:
+        conn.close()
+    return email, password
+
+
+def session_value(at, key, default=None):
+    try:
+        return at.session_state[key]
+    except KeyError:
+        return default
+
+
+def page_label(at):
+    if not session_value(at, "logged_in", False):
+        return "login"
+    return f"section_{session_value(at, 'current_section', 1)}"
+
+
+def fill_inputs(at, email, password, weeks):
+    for widget in at.text_input:
+        if not widget.value:
+            if widget.label == "Email:":
+                widget.set_value(email)
+            elif "Password" in widget.label:
+                widget.set_value(password)
+            else:
+                widget.set_value("Benchmark")
+    for widget in at.text_area:
+        if not widget.value:
+            widget.set_value(" ".join(["A considered benchmark answer."] * 12))
+    for widget in at.radio:
+        if widget.value is None and widget.options:
+            widget.set_value(widget.options[0])
+    for widget in at.slider:
+        if widget.label == "Number of weeks:":
+            widget.set_value(weeks)
+
+
+def next_action(at):
+    buttons = {button.label: button for button in at.button if not button.disabled}
+    for label in ACTIONS:
+        if label in buttons:
+            return label, buttons[label]
+    if page_label(at) == "section_7":
+        # The analysis page has no "next" button; use the sidebar navigation like a student would
+        at.sidebar.selectbox[0].select("Section 8: Final Course Generation")
+        return "Navigate", at.sidebar.button[[b.label for b in at.sidebar.button].index("Navigate")]
+    return None, None
+
+
+def drive_student(weeks=2, timeout=600, on_rerun=None):
+    """Run one student through the whole flow; returns a list of rerun records.
+    Each record is a dict with page, action, seconds, db_calls and llm_calls."""
+    at = AppTest.from_file(APP_PATH, default_timeout=timeout)
+    records = []
+
+    def rerun(page, action, run):
+        db_before, llm_before = scrape_totals()
+        started = time.perf_counter()
+        run()
+        seconds = time.perf_counter() - started
+        db_after, llm_after = scrape_totals()
+        if at.exception:
+            raise RuntimeError(f"{page} / {action}: {at.exception[0].message}")
+        record = {"page": page, "action": action, "seconds": seconds,
+                  "db_calls": db_after - db_before, "llm_calls": llm_after - llm_before}
+        records.append(record)
+        if on_rerun:
+            on_rerun(record)
+
+    rerun("login", "open", at.run)
+    email, password = seed_student_login()  # after the first run, which applies the schema migrations
+    for _ in range(MAX_STEPS):
+        if session_value(at, "final_video_job_id"):
+            return records
+        page = page_label(at)
+        fill_inputs(at, email, password, weeks)
+        label, button = next_action(at)
+        if button is None:
+            raise RuntimeError(f"No action available on {page}")
+        rerun(page, label, lambda: button.click().run())
+    raise RuntimeError(f"Student did not finish within {MAX_STEPS} reruns (last page {page_label(at)})")
+
+
+def share_apptest_runtime():
+    """Let several AppTest sessions run at once in this process.
+    AppTest installs a fresh mock Runtime for every run and clears it afterwards, which
+    races when students rerun concurrently. Install one shared mock for the whole process
+    and give AppTest a detached class to write to instead."""
+    from unittest.mock import MagicMock
+    import streamlit.testing.v1.app_test as app_test
+    from streamlit.runtime import Runtime
+    from streamlit.runtime.caching.storage.dummy_cache_storage import MemoryCacheStorageManager
+    from streamlit.runtime.media_file_manager import MediaFileManager
+    from streamlit.runtime.memory_media_file_storage import MemoryMediaFileStorage
+    runtime = MagicMock(spec=Runtime)
+    runtime.media_file_mgr = MediaFileManager(MemoryMediaFileStorage("/mock/media"))
+    runtime.cache_storage_manager = MemoryCacheStorageManager()
+    Runtime._instance = runtime
+    app_test.Runtime = type("DetachedRuntime", (), {"_instance": None})
+
+
+def scrape_gauge(metric):
+    try:
+        text = urllib.request.urlopen(metrics_url(), timeout=5).read().decode("utf-8")
+    except OSError:
+        return 0.0
+    for line in text.splitlines():
+        if line.startswith(metric + " "):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
@@ -0,0 +1,192 @@
+"""Deterministic stand-ins for Gemini and Tavus used by the benchmark and load harnesses.
+
+install_fake_gemini() replaces google.generativeai in sys.modules, so app.py's lazy
+`import google.generativeai` picks up FakeGenerativeModel. Responses depend only on the
+prompt, and every call sleeps for a configurable latency so timings resemble real traffic.
+"""
+import hashlib
+import itertools
+import json
+import re
+import sys
+import threading
+import time
+import types
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+FAKE_LLM = {
+    "latency": 0.5,  # seconds before the first token
+    "seconds_per_1k_chars": 0.2,  # additional generation time per 1,000 response characters
+    "stream_chunks": 8,
+    "calls": 0,
+    "lock": threading.Lock(),
+}
+
+
+def prompt_digest(prompt):
+    return int(hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8], 16)
+
+
+def fake_question(question_type, seed, number):
+    options = [f"Option {letter} for question {number}" for letter in "ABCD"]
+    question = {
+        "question_text": f"Benchmark question {number} ({seed % 1000})?",
+        "question_type": question_type,
+        "explanation": "Generated by the fake Gemini backend.",
+    }
+    if question_type == "fill_in_the_blank":
+        question["question_text"] = f"Benchmark fill in the _____ number {number}."
+        question["correct_answer"] = "blank"
+    elif question_type == "multi_select":
+        question["options"] = options
+        question["correct_answers"] = options[:2]
+    else:
+        question["options"] = options
+        question["correct_answer"] = options[(seed + number) % 4]
+    return question
+
+
+def fake_response_text(prompt):
+    """A response shaped like what the app's call site expects for this prompt"""
+    seed = prompt_digest(prompt)
+    if "mini quiz (MCQ) for each of these" in prompt:
+        topic_nos = [int(n) for n in re.findall(r"^(\d+)\. ", prompt, re.MULTILINE)]
+        return json.dumps([dict(fake_question("mcq", seed, n), topic_no=n) for n in topic_nos])
+    if "viva voce question" in prompt:
+        return json.dumps({
+            "question": "Explain how you would evaluate a model on an imbalanced dataset.",
+            "expected_points": ["Metrics", "Resampling", "Validation"],
+            "evaluation_criteria": "Coverage of the expected points",
+        })
+    if "quiz questions for Week" in prompt:
+        return json.dumps([fake_question("mcq", seed, n) for n in range(1, 4)])
+    question_type = re.search(r'"question_type": "(\w+)"', prompt)
+    count = re.search(r"Generate (\d+)", prompt)
+    if question_type and count:
+        return json.dumps([fake_question(question_type.group(1), seed, n) for n in range(1, int(count.group(1)) + 1)])
+    if "Topic 1:" in prompt:
+        return "\n\n".join(
+            f"Topic {n}: Benchmark topic {n}\n" + " ".join(["Explanation sentence for this topic."] * 40)
+            for n in range(1, 4)
+        )
+    return ("## 🎬 Video Prompt:\nA short explainer.\n\n## 📝 Script:\nWelcome to the course.\n"
+            + " ".join(["This is benchmark filler text."] * 60))
+
+
+class FakeUsage:
+    def __init__(self, prompt, text):
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(text) // 4
+
+
+class FakeChunk:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponse:
+    def __init__(self, prompt, text, stream):
+        self.text = text
+        self.usage_metadata = FakeUsage(prompt, text)
+        self._stream = stream
+
+    def __iter__(self):
+        size = max(1, len(self.text) // FAKE_LLM["stream_chunks"] + 1)
+        chunk_delay = FAKE_LLM["seconds_per_1k_chars"] * size / 1000
+        for start in range(0, len(self.text), size):
+            time.sleep(chunk_delay)
+            yield FakeChunk(self.text[start:start + size])
+
+
+class FakeGenerativeModel:
+    def __init__(self, model_name, generation_config=None, **kwargs):
+        self.model_name = model_name
+        self._generation_config = generation_config or {}
+        self._client = None
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        with FAKE_LLM["lock"]:
+            FAKE_LLM["calls"] += 1
+        text = fake_response_text(prompt)
+        time.sleep(FAKE_LLM["latency"])
+        if not stream:
+            time.sleep(FAKE_LLM["seconds_per_1k_chars"] * len(text) / 1000)
+        return FakeResponse(prompt, text, stream)
+
+
+def install_fake_gemini(latency=None, seconds_per_1k_chars=None):
+    """Route app.py's Gemini imports to the fake backend"""
+    if latency is not None:
+        FAKE_LLM["latency"] = latency
+    if seconds_per_1k_chars is not None:
+        FAKE_LLM["seconds_per_1k_chars"] = seconds_per_1k_chars
+    genai = types.ModuleType("google.generativeai")
+    genai.GenerativeModel = FakeGenerativeModel
+    genai.configure = lambda **kwargs: None
+    glm = types.ModuleType("google.ai.generativelanguage")
+    glm.GenerativeServiceClient = lambda **kwargs: None
+    google = sys.modules.get("google") or types.ModuleType("google")
+    if not hasattr(google, "__path__"):
+        google.__path__ = []
+    google_ai = types.ModuleType("google.ai")
+    google_ai.__path__ = []
+    google_ai.generativelanguage = glm
+    google.generativeai = genai
+    google.ai = google_ai
+    sys.modules.update({
+        "google": google,
+        "google.ai": google_ai,
+        "google.ai.generativelanguage": glm,
+        "google.generativeai": genai,
+    })
+
+
+def fake_llm_calls():
+    with FAKE_LLM["lock"]:
+        return FAKE_LLM["calls"]
+
+
+def start_fake_tavus(render_seconds=5.0):
+    """Serve a Tavus-compatible /videos API on a free local port; returns its base URL.
+    A video reports "completed" render_seconds after it was created."""
+    videos = {}
+    ids = itertools.count(1)
+    lock = threading.Lock()
+
+    class TavusHandler(BaseHTTPRequestHandler):
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            if self.path.rstrip("/") != "/videos":
+                self.send_json(404, {"error": "not found"})
+                return
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with lock:
+                video_id = f"fake-{next(ids)}"
+                videos[video_id] = time.monotonic()
+            self.send_json(200, {"video_id": video_id, "status": "queued"})
+
+        def do_GET(self):
+            video_id = self.path.rstrip("/").rsplit("/", 1)[-1]
+            with lock:
+                created = videos.get(video_id)
+            if created is None:
+                self.send_json(404, {"error": "unknown video"})
+            elif time.monotonic() - created < render_seconds:
+                self.send_json(200, {"video_id": video_id, "status": "generating"})
+            else:
+                self.send_json(200, {"video_id": video_id, "status": "completed",
+                                     "download_url": f"http://127.0.0.1/fake-videos/{video_id}.mp4"})
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), TavusHandler)
+    threading.Thread(target=server.serve_forever, name="fake-tavus", daemon=True).start()
+    return f"http://127.0.0.1:{server.server_address[1]}"
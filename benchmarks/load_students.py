@@ -0,0 +1,132 @@
+"""Load harness: N simulated students walk login_page → section_8 at once in one process.
+
+    DB_NAME=ai_bench python -m benchmarks.load_students --students 1,4,8,16
+
+All students share this process's st.cache_resource state (DB pool, executors, LLM cache)
+exactly like sessions of one Streamlit server, and one Postgres. For each N it reports
+throughput, rerun tail latency, Postgres backend and pool connection counts, and memory
+growth per session. Levels run in order against the same process and database, so the
+LLM cache and question bank are warm after the first level; use a scratch database.
+"""
+import argparse
+import json
+import os
+import threading
+import time
+
+import psycopg2
+
+from benchmarks.bench_sections import percentile, prepare_environment
+
+SAMPLE_INTERVAL_SECONDS = 0.5
+
+
+def rss_mb():
+    """Resident set size of this process (Linux)"""
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def sample_resources(stop, samples):
+    """Record memory, Postgres backends and pool usage until stop is set"""
+    from benchmarks.driver import scrape_gauge
+    conn = psycopg2.connect(
+        host=os.environ.get("DB_HOST", "localhost"), dbname=os.environ.get("DB_NAME", "AI_2"),
+        user=os.environ.get("DB_USER", "postgres"), password=os.environ.get("DB_PASSWORD", "123456"),
+        port=os.environ.get("DB_PORT", "5432"),
+    )
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cursor:
+            while not stop.is_set():
+                cursor.execute("SELECT COUNT(*) - 1 FROM pg_stat_activity WHERE datname = current_database()")
+                samples.append({
+                    "rss_mb": rss_mb(),
+                    "pg_backends": cursor.fetchone()[0],
+                    "pool_in_use": scrape_gauge("db_pool_in_use"),
+                    "pool_wait_max": scrape_gauge("db_pool_checkout_wait_seconds_max"),
+                })
+                stop.wait(SAMPLE_INTERVAL_SECONDS)
+    finally:
+        conn.close()
+
+
+def run_level(students, weeks):
+    from benchmarks.driver import drive_student
+    records, failures, lock = [], [], threading.Lock()
+
+    def student():
+        try:
+            result = drive_student(weeks=weeks)
+            with lock:
+                records.extend(result)
+        except Exception as e:
+            with lock:
+                failures.append(str(e))
+
+    stop, samples = threading.Event(), []
+    baseline_rss = rss_mb()
+    sampler = threading.Thread(target=sample_resources, args=(stop, samples), daemon=True)
+    sampler.start()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=student, name=f"student-{n}") for n in range(students)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall_seconds = time.perf_counter() - started
+    stop.set()
+    sampler.join()
+    latencies = [record["seconds"] for record in records]
+    completed = students - len(failures)
+    return {
+        "students": students,
+        "completed": completed,
+        "failures": failures,
+        "wall_seconds": wall_seconds,
+        "students_per_minute": completed * 60 / wall_seconds,
+        "reruns_per_second": len(records) / wall_seconds,
+        "rerun_p50": percentile(latencies, 50),
+        "rerun_p95": percentile(latencies, 95),
+        "rerun_p99": percentile(latencies, 99),
+        "pg_backends_max": max((s["pg_backends"] for s in samples), default=0),
+        "pool_in_use_max": max((s["pool_in_use"] for s in samples), default=0),
+        "pool_wait_max": max((s["pool_wait_max"] for s in samples), default=0),
+        "rss_mb_per_session": (max((s["rss_mb"] for s in samples), default=baseline_rss) - baseline_rss) / students,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[0])
+    parser.add_argument("--students", default="1,2,4,8", help="comma-separated concurrency levels")
+    parser.add_argument("--weeks", type=int, default=2)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--llm-seconds-per-1k", type=float, default=0.2)
+    parser.add_argument("--tavus-render-seconds", type=float, default=5.0)
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+    prepare_environment(args.llm_latency, args.llm_seconds_per_1k, args.tavus_render_seconds)
+    from benchmarks.driver import share_apptest_runtime
+    share_apptest_runtime()
+    results = []
+    print(f"{'N':>4}{'done':>6}{'wall':>9}{'stud/min':>10}{'rerun/s':>9}{'p50':>8}{'p95':>8}{'p99':>8}"
+          f"{'pg conns':>10}{'pool max':>10}{'pool wait':>11}{'MB/sess':>9}")
+    for students in [int(n) for n in args.students.split(",")]:
+        result = run_level(students, args.weeks)
+        results.append(result)
+        print(f"{students:>4}{result['completed']:>6}{result['wall_seconds']:>8.1f}s{result['students_per_minute']:>10.2f}"
+              f"{result['reruns_per_second']:>9.2f}{result['rerun_p50']:>7.2f}s{result['rerun_p95']:>7.2f}s"
+              f"{result['rerun_p99']:>7.2f}s{result['pg_backends_max']:>10}{result['pool_in_use_max']:>10.0f}"
+              f"{result['pool_wait_max']:>10.2f}s{result['rss_mb_per_session']:>9.1f}")
+        for failure in result["failures"][:3]:
+            print(f"     failed: {failure}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "levels": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
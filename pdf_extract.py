@@ -0,0 +1,8 @@
+"""PDF page-range text extraction, kept importable so app.py can run it in worker processes."""
+import fitz
+
+
+def extract_page_range(pdf_bytes, start, stop):
+    """Return the text of pages [start, stop) of an in-memory PDF."""
+    with fitz.open(stream=pdf_bytes, filetype="pdf") as pdf_doc:
+        return [pdf_doc[page_no].get_text() for page_no in range(start, stop)]
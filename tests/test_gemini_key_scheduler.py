@@ -0,0 +1,49 @@
+"""Gemini key scheduling: calls stay on their own key unless it is cooling down or at a configured limit."""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("psycopg2")
+
+import app
+
+
+@pytest.fixture
+def scheduler(monkeypatch):
+    """A fresh scheduler over three distinct keys, with the per-key limits off"""
+    monkeypatch.setattr(app, "GEMINI_KEY_REQUESTS_PER_MINUTE", 0)
+    monkeypatch.setattr(app, "GEMINI_KEY_MAX_IN_FLIGHT", 0)
+    monkeypatch.setattr(app, "GEMINI_PINNED_CALL_SITES", set())
+    now = time.monotonic()
+    state = {"condition": threading.Condition(), "keys": {key: app.new_gemini_key_state(now) for key in ("q", "v", "a")}}
+    monkeypatch.setattr(app, "get_gemini_key_scheduler", lambda: state)
+    return state
+
+
+def test_limits_off_keep_concurrent_calls_on_their_own_key(scheduler):
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        keys = list(pool.map(lambda _: app.acquire_gemini_key("q", "questions"), range(4)))
+    assert keys == ["q"] * 4
+    assert sum(state["rerouted"] for state in scheduler["keys"].values()) == 0
+
+
+def test_cooling_key_routes_to_another_key(scheduler):
+    app.release_gemini_key(app.acquire_gemini_key("q", "questions"), throttled=True)
+    assert app.acquire_gemini_key("q", "questions") != "q"
+    assert scheduler["keys"]["q"]["cooldown_until"] > time.monotonic()
+
+
+def test_in_flight_limit_routes_only_the_overflow(scheduler, monkeypatch):
+    monkeypatch.setattr(app, "GEMINI_KEY_MAX_IN_FLIGHT", 2)
+    keys = [app.acquire_gemini_key("q", "questions") for _ in range(3)]
+    assert keys[:2] == ["q", "q"] and keys[2] != "q"
+
+
+def test_pinned_call_site_waits_for_its_own_key(scheduler, monkeypatch):
+    monkeypatch.setattr(app, "GEMINI_PINNED_CALL_SITES", {"agent_course_fetch"})
+    monkeypatch.setattr(app, "GEMINI_KEY_WAIT_MAX", 0.05)
+    app.release_gemini_key(app.acquire_gemini_key("q", "agent_course_fetch"), throttled=True)
+    assert app.acquire_gemini_key("q", "agent_course_fetch") == "q"
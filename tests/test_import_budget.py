@@ -0,0 +1,47 @@
+"""Cold-start cost: a fresh `import app` stays within budget and leaves the heavy modules unloaded.
+
+fitz, docx, the Gemini SDK, requests and pandas are imported where first used, so the
+login page and plain reruns never load them.
+"""
+import os
+import subprocess
+import sys
+
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("psycopg2")
+
+IMPORT_TIME_BUDGET_SECONDS = 3.0  # cumulative import time of app.py in a fresh interpreter
+LAZY_IMPORTS = ["fitz", "docx", "pdf_extract", "google.generativeai", "google.ai.generativelanguage", "requests", "pandas"]
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture(scope="module")
+def import_timings():
+    """Modules loaded by `import app` under python -X importtime, and the top-level import seconds"""
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", "import app"],
+                            cwd=APP_DIR, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr[-2000:]
+    loaded, total_us = set(), 0
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        if not cumulative.strip().isdigit():
+            continue
+        loaded.add(name.strip())
+        if not name.startswith("  "):  # top-level imports; nested ones are indented further
+            total_us += int(cumulative)
+    return loaded, total_us / 1e6
+
+
+@pytest.mark.parametrize("module", LAZY_IMPORTS)
+def test_module_is_not_imported_eagerly(import_timings, module):
+    loaded, _ = import_timings
+    assert module not in loaded
+
+
+def test_import_time_within_budget(import_timings):
+    _, seconds = import_timings
+    assert seconds <= IMPORT_TIME_BUDGET_SECONDS
@@ -0,0 +1,29 @@
+"""db_* metric labels: every statement is counted under its verb and main table.
+
+    python -m pytest tests
+
+Importing app.py runs its page code in Streamlit's bare mode; no database is needed.
+"""
+import pytest
+
+pytest.importorskip("streamlit")
+pytest.importorskip("psycopg2")
+
+from app import sql_statement_label
+
+
+@pytest.mark.parametrize("query, expected", [
+    ("SELECT response, EXTRACT(EPOCH FROM expires_at - CURRENT_TIMESTAMP) FROM llm_cache WHERE cache_key = %s",
+     "SELECT llm_cache"),
+    ("""SELECT pa.*, COALESCE((SELECT json_agg(row_to_json(wq) ORDER BY wq.week_no)
+        FROM week_quiz wq WHERE wq.roll_no = pa.roll_no), '[]') AS week_quizzes
+        FROM pre_assessment pa LEFT JOIN overall_performance op ON pa.roll_no = op.roll_no""",
+     "SELECT pre_assessment"),
+    ("SELECT ')(' AS x, (SELECT 1 FROM a) FROM b", "SELECT b"),
+    ("SELECT pg_advisory_lock(%s)", "SELECT"),
+    ("UPDATE video_jobs SET attempts = attempts + 1 WHERE id IN (SELECT id FROM video_jobs)", "UPDATE video_jobs"),
+    ("INSERT INTO llm_cache (cache_key) VALUES (%s)", "INSERT llm_cache"),
+    ("DELETE FROM llm_cache WHERE expires_at < CURRENT_TIMESTAMP", "DELETE llm_cache"),
+])
+def test_sql_statement_label(query, expected):
+    assert sql_statement_label(query) == expected